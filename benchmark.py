@@ -0,0 +1,533 @@
+"""
+Usage:  python benchmark.py build -n 2000 --backend array dataframe [--trace]
+        python benchmark.py pool -n 200000 --patterns 200000 --workers 1 2 4
+        python benchmark.py suite --inputs dna repeats text --sizes 1k 10k 100k [--history benchmarks.json]
+        python benchmark.py compare [--history benchmarks.json] [--threshold 0.1] [BASE NEW]
+        python benchmark.py skipcount -n 100000 --inputs tandem dna
+        python benchmark.py kmers -n 1000000 --inputs dna text -k 0 8 12
+
+build compares suffix tree build throughput of the node storage backends on seeded random text,
+with --trace also of each backend with the golden-file ContextRecorder attached.  Both backends run
+the current builder, children found through the ChildIndex: the dataframe backend is the pandas node
+storage, not the original builder with its find_edge scan, so the ratio is not a before/after speedup.
+For that, time the same input with test.py in a git worktree of the older commit.
+pool measures batched search and stream matching throughput of a QueryPool per number of workers.
+
+suite generates seeded synthetic inputs, no files or network needed:
+    dna       uniform random ACGT
+    repeats   DNA with interspersed copies of earlier stretches (2% mutated) and tandem repeats
+    tandem    DNA of tandem arrays, short units repeated many times and long segments a few times
+    text      words with Zipf distributed frequencies from a seeded vocabulary
+at each size (1k, 10k, 100k, 1M, 10M or a number), and builds every case in a fresh process, measuring
+    build_seconds, chars_per_second      Ukkonen build, finalize_seconds for finalize() after it
+    peak_rss, rss_bytes_per_char         peak resident set size of the process, and its growth per character
+    file_bytes_per_char                  size of the save_mapped file per character
+    load_seconds                         SuffixTree.load_mapped
+    find_us, get_suffixes_us             median and 95th percentile latency of find_all and of get_suffixes
+                                         on the location a StreamMatcher reaches, half the patterns occur
+    matcher_ns_per_value                 StreamMatcher.feed over a query of the same kind
+and appends the run, with the commit and platform, to the history file.
+compare flags the metrics of every case that got worse than threshold between two runs of the
+history (default the last two, or run indices or ids), and exits with status 1 if any did.
+
+skipcount builds repeat-rich input with the builder rules traced by tracemalloc: for every rule
+it sums the transient bytes of each call (the peak of the call above the memory before and after it),
+the temporaries the suffix link walks of _goto_suffix and _skip_count_down allocate, and the skip/count
+hops.  The build time is measured without tracing.
+
+kmers times short probes (find_many, and one count per pattern) on trees without (k 0) and with a
+k-mer jump table of each k, with the time to build the table, its kind and its size.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from time import perf_counter, perf_counter_ns
+
+import numpy as np
+
+from data_source.codes import to_codes
+from suffixtree.builder.tree_builder import TreeBuilder
+from suffixtree.kmer_table import KmerTable
+from suffixtree.matcher import StreamMatcher
+from suffixtree.suffixtree import SuffixTree
+from suffixtree.tree_nodes import NODE_STORES
+from suffixtree.query_pool import QueryPool
+
+SIZES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1M': 1_000_000, '10M': 10_000_000}
+HISTORY = 'benchmarks.json'
+THRESHOLD = 0.1
+# metric: True if higher is better
+METRICS = {
+    'build_seconds': False, 'chars_per_second': True, 'finalize_seconds': False,
+    'peak_rss': False, 'rss_bytes_per_char': False, 'file_bytes_per_char': False, 'load_seconds': False,
+    'find_us_p50': False, 'find_us_p95': False, 'get_suffixes_us_p50': False, 'get_suffixes_us_p95': False,
+    'matcher_ns_per_value': False,
+}
+
+
+def random_text(n, alphabet="ACGT", seed=0):
+    rng = random.Random(seed)
+    return ''.join(rng.choice(alphabet) for _ in range(n)) + "$"
+
+
+def dna_text(n, rng):
+    return ''.join(rng.choices("ACGT", k=n))
+
+
+def repeats_text(n, rng):
+    """DNA where about a third is copies of earlier stretches, with 2% point mutations, and a tenth tandem repeats"""
+    parts, length = [], 0
+    while length < n:
+        kind = rng.random()
+        if kind < 0.35 and parts:
+            copy = list(parts[rng.randrange(len(parts))])
+            for _ in range(len(copy) // 50):
+                copy[rng.randrange(len(copy))] = rng.choice("ACGT")
+            part = ''.join(copy)
+        elif kind < 0.45:
+            part = ''.join(rng.choices("ACGT", k=rng.randint(2, 6))) * rng.randint(5, 50)
+        else:
+            part = ''.join(rng.choices("ACGT", k=rng.randint(100, 1000)))
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)[:n]
+
+
+def tandem_text(n, rng):
+    """DNA made of tandem arrays: units of 1 to 60 values repeated up to 1000 times, about one value in
+    a thousand mutated, and tandem copies of segments up to 5000 values long, the repeat-rich input
+    where suffix link walks skip/count down long edges"""
+    parts, length = [], 0
+    while length < n:
+        if rng.random() < 0.2:
+            unit = ''.join(rng.choices("ACGT", k=rng.randint(500, 5000)))
+            copies = rng.randint(2, 4)
+        else:
+            unit = ''.join(rng.choices("ACGT", k=rng.randint(1, 60)))
+            copies = rng.randint(10, 1000)
+        part = list(unit * copies)
+        for _ in range(len(part) // 1000):
+            part[rng.randrange(len(part))] = rng.choice("ACGT")
+        parts.append(''.join(part))
+        length += len(part)
+    return ''.join(parts)[:n]
+
+
+def words_text(n, rng):
+    """words of a 5000 word vocabulary with frequencies proportional to 1 / rank, spaces and line breaks"""
+    vocabulary = [''.join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(1, 10))) for _ in range(5000)]
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    words, length = [], 0
+    while length < n:
+        batch = rng.choices(vocabulary, weights, k=max(1, (n - length) // 5))
+        words.extend(batch)
+        length += sum(len(word) + 1 for word in batch)
+    return ''.join(f"{word}{' ' if i % 12 else chr(10)}" for i, word in enumerate(words, 1))[:n]
+
+
+INPUTS = {'dna': dna_text, 'repeats': repeats_text, 'tandem': tandem_text, 'text': words_text}
+
+
+def generate(kind, n, seed):
+    """The seeded input of a suite case, the same for the same kind, n and seed"""
+    return INPUTS[kind](n, random.Random(f"{kind}:{n}:{seed}"))
+
+
+def parse_size(size):
+    return SIZES[size] if size in SIZES else int(size)
+
+
+def time_build(text, backend, trace=False):
+    start = perf_counter()
+    tb = TreeBuilder(text, backend=backend, trace=trace)
+    tb.build_tree()
+    return perf_counter() - start
+
+
+def bench_build(args):
+    text = random_text(args.n, args.alphabet, args.seed)
+    print(f"build, {len(text)} characters, alphabet '{args.alphabet}', best of {args.repeat}")
+    results = {}
+    for backend in args.backend:
+        for trace in ((False, True) if args.trace else (False,)):
+            name = f"{backend}+trace" if trace else backend
+            best = min(time_build(text, backend, trace) for _ in range(args.repeat))
+            results[name] = best
+            print(f"  {name:>16}: {best:8.3f}s  {len(text) / best:12,.0f} chars/s")
+    baseline = results.get('dataframe')
+    if baseline:
+        for backend in args.backend:
+            if backend != 'dataframe':
+                print(f"  {backend} storage is {baseline / results[backend]:.1f}x the dataframe storage throughput, "
+                      f"same builder")
+    if args.trace:
+        for backend in args.backend:
+            print(f"  {backend} without tracing is {results[f'{backend}+trace'] / results[backend]:.1f}x "
+                  f"the traced throughput")
+    return results
+
+
+def bench_pool(args):
+    text = random_text(args.n, args.alphabet, args.seed)
+    rng = random.Random(args.seed + 1)
+    patterns = []
+    for _ in range(args.patterns):
+        start = rng.randrange(len(text) - args.pattern_length)
+        patterns.append(text[start:start + args.pattern_length])
+    query = random_text(args.patterns, args.alphabet, args.seed + 2)[:-1]
+    path_prefix = os.path.join(tempfile.mkdtemp(), 'pool')
+    TreeBuilder(text).build_tree().save_mapped(path_prefix)
+    print(f"pool, {len(text)} character tree, {len(patterns)} patterns of {args.pattern_length}, "
+          f"{len(query)} character stream")
+    results = {}
+    for workers in args.workers:
+        with QueryPool(path_prefix, workers) as pool:
+            pool.find_many(patterns[:workers])
+            start = perf_counter()
+            pool.find_many(patterns, chunk_size=-(-len(patterns) // (4 * workers)))
+            find_time = perf_counter() - start
+            start = perf_counter()
+            pool.matching_statistics(query, chunk_size=-(-len(query) // (4 * workers)))
+            stream_time = perf_counter() - start
+        results[workers] = find_time, stream_time
+        print(f"  {workers:>3} workers: {len(patterns) / find_time:12,.0f} patterns/s  "
+              f"{len(query) / stream_time:12,.0f} stream chars/s")
+    return results
+
+
+def peak_rss():
+    """peak resident set size of this process in bytes"""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _percentiles(name, nanoseconds):
+    p50, p95 = np.percentile(np.asarray(nanoseconds) / 1000, [50, 95])
+    return {f'{name}_p50': float(p50), f'{name}_p95': float(p95)}
+
+
+def run_case(kind, n, seed, queries):
+    """The metrics of one suite case, run in a fresh process so peak_rss is its own"""
+    text = generate(kind, n, seed)
+    rng = random.Random(f"queries:{kind}:{n}:{seed}")
+    patterns = []
+    for i in range(queries):
+        length = rng.randint(8, 32)
+        if i % 2:
+            patterns.append(generate(kind, length, rng.randrange(1 << 30)))
+        else:
+            start = rng.randrange(max(1, n - length))
+            patterns.append(text[start:start + length])
+    query = generate(kind, min(n, 100_000), seed + 1)
+    metrics = {}
+    baseline = peak_rss()
+
+    start = perf_counter()
+    st = TreeBuilder(text + "$").build_tree()
+    metrics['build_seconds'] = perf_counter() - start
+    metrics['chars_per_second'] = n / metrics['build_seconds']
+    start = perf_counter()
+    st.finalize()
+    metrics['finalize_seconds'] = perf_counter() - start
+    metrics['peak_rss'] = peak_rss()
+    metrics['rss_bytes_per_char'] = (metrics['peak_rss'] - baseline) / n
+
+    with tempfile.TemporaryDirectory() as directory:
+        path_prefix = os.path.join(directory, 'tree')
+        st.save_mapped(path_prefix)
+        metrics['file_bytes_per_char'] = os.path.getsize(f'{path_prefix}.npst') / n
+        start = perf_counter()
+        loaded = SuffixTree.load_mapped(path_prefix)
+        metrics['load_seconds'] = perf_counter() - start
+        del loaded
+
+    find_times, suffixes_times = [], []
+    matcher = StreamMatcher(st)
+    for pattern in patterns:
+        start = perf_counter_ns()
+        st.find_all(pattern)
+        find_times.append(perf_counter_ns() - start)
+        matcher.reset()
+        for match in matcher.match(pattern):
+            pass
+        if matcher.match_length:
+            location = matcher.location()
+            start = perf_counter_ns()
+            st.get_suffixes(location)
+            suffixes_times.append(perf_counter_ns() - start)
+    metrics.update(_percentiles('find_us', find_times))
+    metrics.update(_percentiles('get_suffixes_us', suffixes_times or [0]))
+
+    matcher.reset()
+    start = perf_counter_ns()
+    for value in query.encode('latin-1'):
+        matcher.feed(value)
+    metrics['matcher_ns_per_value'] = (perf_counter_ns() - start) / len(query)
+    return metrics
+
+
+def best_metrics(repeats):
+    """the best value of every metric over repeated runs of a case"""
+    return {metric: (max if METRICS[metric] else min)(metrics[metric] for metrics in repeats)
+            for metric in repeats[0]}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as in_file:
+        return json.load(in_file)
+
+
+def write_history(path, runs):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as out_file:
+        json.dump(runs, out_file, indent=1)
+    os.replace(tmp_path, path)
+
+
+def bench_suite(args):
+    run = {
+        'id': datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ'),
+        'commit': git_commit(),
+        'label': args.label,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'cases': [],
+    }
+    print(f"suite {run['id']} at {run['commit']}, seed {args.seed}, {args.queries} queries per case, "
+          f"best of {args.repeat}")
+    print(f"  {'case':>14} {'chars/s':>10} {'peak MB':>8} {'RSS B/ch':>8} {'file B/ch':>9} {'load s':>7} "
+          f"{'find us':>8} {'suff us':>8} {'match ns':>8}")
+    spawn = multiprocessing.get_context('spawn')
+    for kind in args.inputs:
+        for size in args.sizes:
+            n = parse_size(size)
+            repeats = []
+            for _ in range(args.repeat):
+                with ProcessPoolExecutor(1, mp_context=spawn) as executor:
+                    repeats.append(executor.submit(run_case, kind, n, args.seed, args.queries).result())
+            metrics = best_metrics(repeats)
+            run['cases'].append({'input': kind, 'size': n, 'metrics': metrics})
+            print(f"  {kind + '/' + size:>14} {metrics['chars_per_second']:10,.0f} "
+                  f"{metrics['peak_rss'] / 2 ** 20:8.1f} {metrics['rss_bytes_per_char']:8.1f} "
+                  f"{metrics['file_bytes_per_char']:9.1f} {metrics['load_seconds']:7.3f} "
+                  f"{metrics['find_us_p50']:8.1f} {metrics['get_suffixes_us_p50']:8.1f} "
+                  f"{metrics['matcher_ns_per_value']:8.0f}")
+    runs = read_history(args.history)
+    runs.append(run)
+    write_history(args.history, runs)
+    print(f"run {len(runs) - 1} ({run['id']}) appended to {args.history}")
+    return run
+
+
+def find_run(runs, key):
+    """a run of the history by index (negative counts from the end) or by id"""
+    for run in runs:
+        if run['id'] == key:
+            return run
+    try:
+        return runs[int(key)]
+    except (ValueError, IndexError):
+        raise SystemExit(f"no run {key!r} in the history, it has {len(runs)} runs")
+
+
+def compare_runs(base, new):
+    """(case, metric, base value, new value, worse) of every metric in both runs,
+    worse is the relative change, positive when the metric got worse"""
+    base_cases = {(case['input'], case['size']): case['metrics'] for case in base['cases']}
+    changes = []
+    for case in new['cases']:
+        key = (case['input'], case['size'])
+        if key not in base_cases:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            before, after = base_cases[key].get(metric), case['metrics'].get(metric)
+            if before is None or after is None or before <= 0:
+                continue
+            change = (after - before) / before
+            changes.append((key, metric, before, after, -change if higher_is_better else change))
+    return changes
+
+
+def bench_compare(args):
+    runs = read_history(args.history)
+    base, new = find_run(runs, args.base), find_run(runs, args.new)
+    print(f"base {base['id']} at {base['commit']}, new {new['id']} at {new['commit']}, "
+          f"regression threshold {args.threshold:.0%}")
+    regressions = 0
+    for (kind, size), metric, before, after, worse in compare_runs(base, new):
+        flag = ''
+        if worse > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        elif worse < -args.threshold:
+            flag = '  improved'
+        if flag or args.all:
+            print(f"  {f'{kind}/{size}':>14} {metric:>22}: {before:12.4g} -> {after:12.4g}  {worse:+7.1%}{flag}")
+    print(f"{regressions} regressions")
+    return regressions
+
+
+class AllocationObserver:
+    """Build observer summing the transient bytes allocated by each rule call, with tracemalloc"""
+
+    def __init__(self):
+        self.rules = {}
+        self.before = 0
+
+    def step_processing(self, offset, value):
+        pass
+
+    def before_rule(self, fn, context):
+        self.hops = context.hops
+        tracemalloc.reset_peak()
+        self.before = tracemalloc.get_traced_memory()[0]
+
+    def after_rule(self, fn, context):
+        current, peak = tracemalloc.get_traced_memory()
+        calls, transient, largest, hops = self.rules.get(fn.__name__, (0, 0, 0, 0))
+        call = peak - max(current, self.before)
+        self.rules[fn.__name__] = (calls + 1, transient + call, max(largest, call), hops + context.hops - self.hops)
+
+
+def bench_skipcount(args):
+    results = {}
+    for kind in args.inputs:
+        text = generate(kind, args.n, args.seed) + "$"
+        seconds = min(time_build(text, 'array') for _ in range(args.repeat))
+        builder = TreeBuilder(text)
+        observer = AllocationObserver()
+        builder.attach(observer)
+        tracemalloc.start()
+        try:
+            builder.build_tree()
+        finally:
+            tracemalloc.stop()
+        results[kind] = seconds, observer.rules
+        print(f"skipcount, {kind} {len(text)} characters, {len(text) / seconds:,.0f} chars/s untraced")
+        print(f"  {'rule':>22} {'calls':>9} {'transient bytes':>16} {'bytes/call':>10} {'largest':>9} {'hops':>9}")
+        for name, (calls, transient, largest, hops) in sorted(observer.rules.items(), key=lambda item: -item[1][1]):
+            print(f"  {name:>22} {calls:9} {transient:16,} {transient / calls:10.1f} {largest:9,} {hops:9}")
+    return results
+
+
+def bench_kmers(args):
+    results = {}
+    for kind in args.inputs:
+        text = generate(kind, args.n, args.seed) + "$"
+        st = TreeBuilder(text).build_tree()
+        rng = random.Random(args.seed + 1)
+        patterns = []
+        for _ in range(args.patterns):
+            length = rng.randint(args.min_length, args.max_length)
+            start = rng.randrange(len(text) - length)
+            patterns.append(text[start:start + length])
+        print(f"kmers, {kind} {len(text)} characters, {len(patterns)} patterns of {args.min_length}-{args.max_length}")
+        for k in args.k:
+            start = perf_counter()
+            st.kmers = KmerTable.build(st, k) if k else None
+            build_time = perf_counter() - start
+            if st.kmers is not None:
+                st.kmers.lookup(to_codes(patterns[0]))
+            start = perf_counter()
+            st.find_many(patterns)
+            find_time = perf_counter() - start
+            start = perf_counter()
+            for pattern in patterns:
+                st.count(pattern)
+            count_time = perf_counter() - start
+            table = 'no table' if st.kmers is None else f"{st.kmers.kind} {len(st.kmers):,} entries"
+            results[kind, k] = build_time, find_time, count_time
+            print(f"  k {k:>2}: {len(patterns) / find_time:12,.0f} find_many patterns/s "
+                  f"{len(patterns) / count_time:12,.0f} count patterns/s  built in {build_time:.2f}s, {table}")
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='build throughput per node storage backend')
+    build.add_argument('-n', help='number of random characters', type=int, default=2000)
+    build.add_argument('--alphabet', default='ACGT')
+    build.add_argument('--seed', type=int, default=0)
+    build.add_argument('--repeat', type=int, default=3)
+    build.add_argument('--backend', nargs='+', choices=sorted(NODE_STORES), default=['array', 'dataframe'])
+    build.add_argument('--trace', action='store_true', help='also time builds with a ContextRecorder attached')
+    build.set_defaults(fn=bench_build)
+
+    pool = subparsers.add_parser('pool', help='QueryPool throughput per number of workers')
+    pool.add_argument('-n', help='number of random characters in the tree', type=int, default=200_000)
+    pool.add_argument('--alphabet', default='ACGT')
+    pool.add_argument('--seed', type=int, default=0)
+    pool.add_argument('--patterns', help='number of patterns, and of stream characters', type=int, default=200_000)
+    pool.add_argument('--pattern-length', type=int, default=20, dest='pattern_length')
+    pool.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4])
+    pool.set_defaults(fn=bench_pool)
+
+    suite = subparsers.add_parser('suite', help='seeded synthetic inputs, metrics appended to a history file')
+    suite.add_argument('--inputs', nargs='+', choices=sorted(INPUTS), default=['dna', 'repeats', 'text'])
+    suite.add_argument('--sizes', nargs='+', help=f"sizes, {', '.join(SIZES)} or a number of characters",
+                       default=['1k', '10k', '100k'])
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--queries', help='patterns per case for the latency metrics', type=int, default=1000)
+    suite.add_argument('--repeat', help='runs per case, the best value of each metric is kept', type=int, default=3)
+    suite.add_argument('--history', default=HISTORY)
+    suite.add_argument('--label', help='free text stored with the run')
+    suite.set_defaults(fn=bench_suite)
+
+    compare = subparsers.add_parser('compare', help='flag regressions between two runs of a history file')
+    compare.add_argument('base', nargs='?', default='-2', help='run index or id, default the second to last')
+    compare.add_argument('new', nargs='?', default='-1', help='run index or id, default the last')
+    compare.add_argument('--history', default=HISTORY)
+    compare.add_argument('--threshold', type=float, default=THRESHOLD,
+                         help='relative change that counts as a regression')
+    compare.add_argument('--all', action='store_true', help='print every metric, not only the changed ones')
+    compare.set_defaults(fn=bench_compare)
+
+    skipcount = subparsers.add_parser('skipcount', help='transient allocations of the builder rules on repeats')
+    skipcount.add_argument('-n', help='number of characters', type=int, default=100_000)
+    skipcount.add_argument('--inputs', nargs='+', choices=sorted(INPUTS), default=['tandem', 'dna'])
+    skipcount.add_argument('--seed', type=int, default=0)
+    skipcount.add_argument('--repeat', type=int, default=3)
+    skipcount.set_defaults(fn=bench_skipcount)
+
+    kmers = subparsers.add_parser('kmers', help='short probe searches with and without a k-mer jump table')
+    kmers.add_argument('-n', help='number of characters', type=int, default=1_000_000)
+    kmers.add_argument('--inputs', nargs='+', choices=sorted(INPUTS), default=['dna', 'text'])
+    kmers.add_argument('-k', nargs='+', type=int, default=[0, 8, 12], help='table k, 0 for no table')
+    kmers.add_argument('--seed', type=int, default=0)
+    kmers.add_argument('--patterns', type=int, default=100_000)
+    kmers.add_argument('--min-length', type=int, default=12, dest='min_length')
+    kmers.add_argument('--max-length', type=int, default=24, dest='max_length')
+    kmers.set_defaults(fn=bench_kmers)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = args.fn(args)
+    if args.command == 'compare' and result:
+        sys.exit(1)
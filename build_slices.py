@@ -0,0 +1,55 @@
+"""
+Usage:  python build_slices.py build --fasta chr1.fa --slices 2:5 4:7 -o built/slices [-j 4]
+        python build_slices.py find -m built/slices/manifest.json ACGTACGT ...
+
+build builds one suffix tree per slice ('record', 'record:min:max' or 'min:max' of the first record),
+one worker process per core, and writes manifest.json next to the trees.
+find searches every tree of a manifest, and prints the hits in record coordinates.
+"""
+import argparse
+import os
+from time import perf_counter
+
+from suffixtree.slices import build_slices, SliceTrees, MANIFEST
+
+
+def build(args):
+    start = perf_counter()
+    manifest = build_slices(args.fasta_file, args.slices, args.out_dir, args.jobs)
+    for entry in manifest['slices']:
+        print(f"{entry['record']}:{entry['start']}+{entry['length']} -> {entry['tree']}")
+    print(f"{len(manifest['slices'])} trees in {perf_counter() - start:.2f}s, "
+          f"manifest {os.path.join(args.out_dir, MANIFEST)}")
+
+
+def find(args):
+    trees = SliceTrees(args.manifest)
+    for pattern in args.patterns:
+        hits = trees.find(pattern)
+        print(f"{pattern}\t{len(hits)}\t" + ' '.join(f"{record}:{offset}" for record, offset in hits))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='build the tree of every slice in parallel')
+    build_parser.add_argument('--fasta', help='fasta file to use as data source', dest='fasta_file', required=True)
+    build_parser.add_argument('--slices', help="slices to build, 'record', 'record:min:max' or 'min:max'",
+                              nargs='+', required=True)
+    build_parser.add_argument('-o', '--out-dir', help='directory for the trees and manifest', dest='out_dir',
+                              required=True)
+    build_parser.add_argument('-j', '--jobs', help='worker processes, defaults to the number of cores', type=int)
+    build_parser.set_defaults(fn=build)
+
+    find_parser = subparsers.add_parser('find', help='search every tree of a manifest')
+    find_parser.add_argument('-m', '--manifest', help='manifest.json written by build', required=True)
+    find_parser.add_argument('patterns', nargs='+')
+    find_parser.set_defaults(fn=find)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.fn(args)
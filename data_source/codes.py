@@ -0,0 +1,122 @@
+"""
+Integer codes for a data source, and the 2-bit packed .data sidecar for DNA.
+
+In memory the data source is a code array: one byte per symbol (the latin-1 code, so a code is
+ord() of its character) or 4 bytes per symbol for wider text.  Indexing a code array gives an int,
+so the builder and the matchers compare codes without ord() calls.
+
+On disk, nucleotide text is packed like UCSC .2bit: 2 bits per base for ACGT, plus runs of
+exceptions (N and other IUPAC symbols, the terminator) and runs of lower-case (soft-masked) bases.
+
+   >>> to_codes("ACGT$")[:2]
+   b'AC'
+   >>> packed = pack_dna(to_codes("ACGTNNNNacgtRAC$"))
+   >>> packed['packed'].nbytes, packed['exception_start'].tolist(), packed['mask_start'].tolist()
+   (4, [4, 12, 15], [8])
+   >>> unpack_dna(packed)
+   b'ACGTNNNNacgtRAC$'
+"""
+from array import array
+
+import numpy as np
+
+from suffixtree.mapped_file import MAGIC, write_sections, open_sections
+
+DNA = b'ACGT'
+N = ord('N')
+NOT_DNA = 255
+
+_BASE_OF = np.full(256, NOT_DNA, dtype=np.uint8)
+_BASE_OF[np.frombuffer(DNA, dtype=np.uint8)] = np.arange(4, dtype=np.uint8)
+
+
+def to_codes(data):
+    """code array for a str (or Bio Seq): bytes when every code fits in a byte, else array('I')"""
+    if isinstance(data, (bytes, bytearray, memoryview, array)):
+        return data
+    text = str(data)
+    try:
+        return text.encode('latin-1')
+    except UnicodeEncodeError:
+        return array('I', map(ord, text))
+
+
+def code_encoding(codes):
+    """the text encoding whose bytes are the code array"""
+    return 'latin-1' if memoryview(codes).itemsize == 1 else 'utf-32-le'
+
+
+def code_view(codes):
+    """a code array as a uint8 or uint32 numpy array over the same memory"""
+    codes = memoryview(codes)
+    return np.frombuffer(codes, dtype=np.uint8 if codes.itemsize == 1 else np.uint32)
+
+
+def _runs(flags):
+    """(start, length) of every run of True in a bool array"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], flags.view(np.int8), [0]))))
+    return edges[0::2], edges[1::2] - edges[0::2]
+
+
+def pack_dna(codes):
+    """2-bit pack a one-byte code array, returns the sections written to a packed .data file"""
+    codes = np.frombuffer(codes, dtype=np.uint8)
+    lower = (codes >= ord('a')) & (codes <= ord('z'))
+    upper = np.where(lower, codes - 32, codes).astype(np.uint8)
+    bases = _BASE_OF[upper]
+    exceptions = bases == NOT_DNA
+    # a new exception run starts wherever the exception value changes
+    boundaries = exceptions & np.concatenate(([True], upper[1:] != upper[:-1]))
+    run_id = np.cumsum(boundaries)[exceptions]
+    starts = np.flatnonzero(boundaries)
+    lengths = np.bincount(run_id, minlength=len(starts) + 1)[1:]
+    mask_start, mask_length = _runs(lower)
+
+    bases = np.where(exceptions, 0, bases)
+    bases = np.concatenate((bases, np.zeros(-len(bases) % 4, dtype=np.uint8))).reshape(-1, 4)
+    packed = bases[:, 0] | (bases[:, 1] << 2) | (bases[:, 2] << 4) | (bases[:, 3] << 6)
+    return {'length': np.array([len(codes)], dtype=np.int64),
+            'packed': packed.astype(np.uint8),
+            'exception_start': starts.astype(np.int64),
+            'exception_length': lengths.astype(np.int64),
+            'exception_value': upper[starts],
+            'mask_start': mask_start.astype(np.int64),
+            'mask_length': mask_length.astype(np.int64)}
+
+
+def unpack_dna(sections):
+    length = int(sections['length'][0])
+    packed = sections['packed']
+    bases = np.stack([(packed >> shift) & 3 for shift in (0, 2, 4, 6)], axis=1).reshape(-1)[:length]
+    codes = np.frombuffer(DNA, dtype=np.uint8)[bases]
+    for start, run_length, value in zip(sections['exception_start'].tolist(), sections['exception_length'].tolist(),
+                                        sections['exception_value'].tolist()):
+        codes[start:start + run_length] = value
+    for start, run_length in zip(sections['mask_start'].tolist(), sections['mask_length'].tolist()):
+        codes[start:start + run_length] += 32
+    return codes.tobytes()
+
+
+def write_data_file(path, data_source):
+    """Write the .data sidecar, 2-bit packed when that is smaller than the text"""
+    codes = to_codes(data_source)
+    if code_encoding(codes) == 'latin-1' and len(codes):
+        sections = pack_dna(codes)
+        packed_size = sum(values.nbytes for values in sections.values())
+        if packed_size < len(codes):
+            write_sections(path, {'format': '2bit'}, sections)
+            return
+    # no newline translation, a text of '\r' codes reads back as it was written
+    with open(path, 'w', encoding='utf-8', newline='') as out_file:
+        out_file.write(str(data_source))
+
+
+def read_data_file(path):
+    """Text of a .data sidecar written by write_data_file (or as plain text)"""
+    with open(path, 'rb') as in_file:
+        packed = in_file.read(len(MAGIC)) == MAGIC
+    if packed:
+        header, sections, mm = open_sections(path)
+        return unpack_dna(sections).decode('latin-1')
+    with open(path, encoding='utf-8', newline='') as in_file:
+        return in_file.read()
@@ -1,27 +1,164 @@
-from Bio import SeqIO
+"""
+Indexed FASTA access: seek straight to a slice of a record instead of parsing the whole file.
 
+The index is the samtools .fai format, one line per record:
+    name, sequence length, byte offset of the first base, bases per line, bytes per line
+It is read from <fasta>.fai when present, otherwise built with one pass over the file and saved there.
 
-def get_fasta_data(seq_file, slice_spec):
-    SEGMENT_SIZE = 100_000
-    print(f"seq_file={seq_file}, slice_spec={slice_spec}")
-    seq_object = SeqIO.read(seq_file, "fasta")
-    sequence = seq_object.seq
-    if slice_spec:
-        data = slice_spec.split(':')
-        min_bound = int(data[0])
-        max_bound = int(data[1])
-        sequence = sequence[(min_bound*SEGMENT_SIZE):(max_bound*SEGMENT_SIZE)]
-    return sequence
-
-
-def get_fasta_data_str(seq_file, slice_spec):
-    SEGMENT_SIZE = 100_000
+   >>> import os, tempfile
+   >>> path = os.path.join(tempfile.mkdtemp(), 'test.fa')
+   >>> with open(path, 'w') as out_file:
+   ...     _ = out_file.write(">chr1 first\\nACGTA\\nCGTAC\\nGT\\n>chr2\\nTTTT\\nGG\\n")
+   >>> fasta = IndexedFasta(path)
+   >>> fasta.names
+   ['chr1', 'chr2']
+   >>> fasta.sequence('chr1', 3, 11)
+   'TACGTACG'
+   >>> list(fasta.fetch('chr1', 1, 12, chunk_size=4))
+   ['CGTA', 'CGTA', 'CGT']
+   >>> fasta.sequence('chr2')
+   'TTTTGG'
+   >>> os.path.exists(f'{path}.fai')
+   True
+
+A blank line ends a record, blank lines between the lines of a record or a header without a name
+are errors, as in samtools faidx:
+
+   >>> with open(path, 'w') as out_file:
+   ...     _ = out_file.write(">a\\nACGT\\nTT\\n\\n>b\\nGG\\n\\n")
+   >>> [(entry.name, entry.length, entry.offset) for entry in build_fai(path)]
+   [('a', 6, 3), ('b', 2, 15)]
+   >>> with open(path, 'w') as out_file:
+   ...     _ = out_file.write(">a\\nACGT\\n\\nTTTT\\nGG\\n")
+   >>> try:
+   ...     build_fai(path)
+   ... except ValueError as error:
+   ...     str(error).split(': ', 1)[1]
+   'record a has a blank line at byte 8'
+   >>> with open(path, 'w') as out_file:
+   ...     _ = out_file.write(">a\\nACGT\\n>\\nTTTT\\n")
+   >>> try:
+   ...     build_fai(path)
+   ... except ValueError as error:
+   ...     str(error).split(': ', 1)[1]
+   'header without a name at byte 8'
+"""
+import os
+from collections import namedtuple
+
+from Bio.Seq import Seq
+
+SEGMENT_SIZE = 100_000
+CHUNK_SIZE = 1 << 20
+
+FaiEntry = namedtuple('FaiEntry', 'name length offset line_bases line_width')
+
+
+def parse_slice(slice_spec, segment_size=SEGMENT_SIZE):
+    """'min:max' in segment_size units -> (start, end) in bases, (0, None) for no slice"""
+    if not slice_spec:
+        return 0, None
+    data = slice_spec.split(':')
+    return int(data[0]) * segment_size, int(data[1]) * segment_size
+
+
+def read_fai(index_path):
+    with open(index_path) as in_file:
+        return [FaiEntry(fields[0], *map(int, fields[1:5]))
+                for fields in (line.rstrip('\n').split('\t') for line in in_file) if fields[0]]
+
+
+def build_fai(fasta_path):
+    """One pass over the file, returns a FaiEntry per record"""
+    entries = []
+    name = None
+    with open(fasta_path, 'rb') as in_file:
+        offset = 0
+        blank_offset = None
+        for line in in_file:
+            line_offset = offset
+            offset += len(line)
+            if line.startswith(b'>'):
+                if name is not None:
+                    entries.append(FaiEntry(name, length, seq_offset, line_bases, line_width))
+                fields = line[1:].split()
+                if not fields:
+                    raise ValueError(f"{fasta_path}: header without a name at byte {line_offset}")
+                name = fields[0].decode()
+                length, seq_offset, line_bases, line_width, last_line_short = 0, offset, 0, 0, False
+                blank_offset = None
+                continue
+            bases = len(line.rstrip(b'\r\n'))
+            if not bases:
+                # blank lines may end a record, the offset arithmetic has no room for them inside one
+                if blank_offset is None:
+                    blank_offset = line_offset
+                continue
+            if blank_offset is not None:
+                raise ValueError(f"{fasta_path}: record {name} has a blank line at byte {blank_offset}")
+            if not line_bases:
+                line_bases, line_width = bases, len(line)
+            elif last_line_short or bases > line_bases:
+                raise ValueError(f"{fasta_path}: record {name} has uneven line lengths at byte {line_offset}")
+            last_line_short = bases < line_bases
+            length += bases
+    if name is not None:
+        entries.append(FaiEntry(name, length, seq_offset, line_bases, line_width))
+    return entries
+
+
+def write_fai(index_path, entries):
+    with open(index_path, 'w') as out_file:
+        for entry in entries:
+            out_file.write('\t'.join(map(str, entry)) + '\n')
+
+
+class IndexedFasta:
+    """Random access to the records of a FASTA file through a .fai index"""
+
+    def __init__(self, fasta_path, index_path=None):
+        self.fasta_path = fasta_path
+        index_path = index_path or f'{fasta_path}.fai'
+        if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(fasta_path):
+            entries = read_fai(index_path)
+        else:
+            entries = build_fai(fasta_path)
+            try:
+                write_fai(index_path, entries)
+            except OSError:
+                pass
+        self.entries = {entry.name: entry for entry in entries}
+        self.names = [entry.name for entry in entries]
+
+    def entry(self, name=None):
+        """index entry for a record, the first record if name is None"""
+        return self.entries[self.names[0] if name is None else name]
+
+    def fetch(self, name=None, start=0, end=None, chunk_size=CHUNK_SIZE):
+        """Generator of str chunks of record name, covering bases [start, end)"""
+        entry = self.entry(name)
+        end = entry.length if end is None else min(end, entry.length)
+        with open(self.fasta_path, 'rb') as in_file:
+            for chunk_start in range(start, end, chunk_size):
+                chunk_end = min(end, chunk_start + chunk_size)
+                first = self._file_offset(entry, chunk_start)
+                in_file.seek(first)
+                raw = in_file.read(self._file_offset(entry, chunk_end - 1) + 1 - first)
+                yield raw.replace(b'\n', b'').replace(b'\r', b'').decode('ascii')
+
+    def sequence(self, name=None, start=0, end=None):
+        return ''.join(self.fetch(name, start, end))
+
+    @staticmethod
+    def _file_offset(entry, position):
+        return entry.offset + (position // entry.line_bases) * entry.line_width + position % entry.line_bases
+
+
+def get_fasta_data(seq_file, slice_spec, record=None):
+    return Seq(get_fasta_data_str(seq_file, slice_spec, record))
+
+
+def get_fasta_data_str(seq_file, slice_spec, record=None):
     print(f"seq_file={seq_file}, slice_spec={slice_spec}")
-    seq_object = SeqIO.read(seq_file, "fasta")
-    sequence = seq_object.seq
-    if slice_spec:
-        data = slice_spec.split(':')
-        min_bound = int(data[0])
-        max_bound = int(data[1])
-        sequence = sequence[(min_bound*SEGMENT_SIZE):(max_bound*SEGMENT_SIZE)]
-    return str(sequence)
\ No newline at end of file
+    start, end = parse_slice(slice_spec)
+    return IndexedFasta(seq_file).sequence(record, start, end)
@@ -61,7 +61,7 @@ if __name__ == '__main__':
     test_str = sys.argv[1]
     with open(f'tests/{sys.argv[2]}') as in_file:
         bc = BuildChecker(in_file.readlines())
-    tb = TreeBuilder(test_str)
+    tb = TreeBuilder(test_str, trace=True)
     data_source_iter = enumerate(iter(test_str))
     while True:
         line = input('>>> ')
@@ -15,11 +15,27 @@ def st_args():
     parser.add_argument('--slice',
                         help='slice into data source, 1Mb units',
                         dest='slice_spec')
+    parser.add_argument('--record',
+                        help='name of the fasta record to use, defaults to the first',
+                        dest='record')
     parser.add_argument('-o', '--output-file',
                         help='path to output file',
                         dest='output_file')
     parser.add_argument('-d', '--depth',
                         help='emit match data when this depth reached', type=int, default=10,
                         dest='emit_depth')
+    parser.add_argument('--min-count',
+                        help='only emit matches occurring at least this many times in the suffix tree', type=int,
+                        dest='min_count')
+    parser.add_argument('--max-count',
+                        help='only emit matches occurring at most this many times in the suffix tree', type=int,
+                        dest='max_count')
+    parser.add_argument('--restart',
+                        help='after a mismatch or an emit, start over at the root or follow a suffix link',
+                        choices=['root', 'suffix_link'], default='root',
+                        dest='restart')
+    parser.add_argument('--profile',
+                        help='profile the matching rules, print a summary and dump the statistics as json here',
+                        dest='profile')
 
     return parser.parse_args()
\ No newline at end of file
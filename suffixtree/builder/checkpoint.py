@@ -0,0 +1,168 @@
+"""
+Periodic checkpoints of a running build, see TreeBuilder.checkpoint_every and TreeBuilder.restore.
+
+A checkpoint directory holds
+    base.npst               a full TreeBuilder.save_state file
+    delta-00000001.npst     the rows changed or added since the previous checkpoint, the data appended
+    delta-00000002.npst     since then and the builder state, ...
+Rows are only appended or updated in place, so a delta is the ids of the updated rows below the previous
+table sizes plus every new row, with their values in each column: its size follows the work done since the
+last checkpoint, not the size of the tables.  Every file is written to a temporary name and renamed,
+so a crash leaves the last complete checkpoint behind.  After compact_after deltas the next
+checkpoint writes a new base and drops the deltas.
+
+Restoring reads the base and applies the deltas written on top of it in order, up to the first
+missing or inconsistent one.
+
+   >>> import tempfile
+   >>> from suffixtree.builder.tree_builder import TreeBuilder
+   >>> directory = tempfile.mkdtemp()
+   >>> tb = TreeBuilder("mississippi$")
+   >>> tb.checkpoint_every(directory, values=3)
+   >>> for offset, value in enumerate(b"mississip"):
+   ...     tb.process_value(offset, value)
+   >>> sorted(os.listdir(directory))
+   ['base.npst', 'delta-00000001.npst', 'delta-00000002.npst', 'delta-00000003.npst']
+   >>> tb = TreeBuilder.restore(directory)
+   >>> tb.next_offset_to_process
+   9
+   >>> print(tb.build_tree().info())
+   12 leaf nodes, 7 internal nodes
+"""
+import os
+import re
+from array import array
+from time import perf_counter
+from uuid import uuid4
+
+import numpy as np
+
+from suffixtree.mapped_file import write_sections, open_sections
+from data_source.codes import code_view
+
+BASE = 'base.npst'
+DELTA = 'delta-{:08d}.npst'
+DELTA_PATTERN = re.compile(r'delta-(\d{8})\.npst$')
+COMPACT_AFTER = 64
+# values between clock reads when checkpointing by time
+CLOCK_INTERVAL = 1024
+TABLES = (('internal', 'n_internal'), ('leaf', 'n_leaf'))
+
+
+def _deltas(directory):
+    """(sequence, path) of the delta files in directory, in order"""
+    deltas = []
+    for name in os.listdir(directory):
+        match = DELTA_PATTERN.match(name)
+        if match:
+            deltas.append((int(match.group(1)), os.path.join(directory, name)))
+    return sorted(deltas)
+
+
+class Checkpointer:
+    """Writes the checkpoints of a builder every `values` processed values and/or every `seconds`"""
+
+    def __init__(self, builder, directory, values=None, seconds=None, compact_after=COMPACT_AFTER):
+        if not values and not seconds:
+            raise ValueError("checkpoint every values or seconds, or both")
+        os.makedirs(directory, exist_ok=True)
+        self.builder = builder
+        self.directory = directory
+        self.every_values = values
+        self.every_seconds = seconds
+        self.compact_after = compact_after
+        self.base_id = None
+        self.sequence = 0
+        st = builder.st
+        st.internal_nodes.dirty = set()
+        st.leaf_nodes.dirty = set()
+        self._mark()
+
+    def _mark(self):
+        """start tracking changes from the current state"""
+        st = self.builder.st
+        self.sizes = {'n_internal': len(st.internal_nodes), 'n_leaf': len(st.leaf_nodes), 'n_data': len(st.codes)}
+        st.internal_nodes.dirty.clear()
+        st.leaf_nodes.dirty.clear()
+        self.values = 0
+        self.last_time = perf_counter()
+
+    def after_value(self):
+        """called by the builder after each processed value"""
+        self.values += 1
+        if self.every_values and self.values >= self.every_values:
+            self.checkpoint()
+        elif (self.every_seconds and not self.values % CLOCK_INTERVAL
+              and perf_counter() - self.last_time >= self.every_seconds):
+            self.checkpoint()
+
+    def checkpoint(self):
+        if self.base_id is None or self.sequence >= self.compact_after:
+            self.write_base()
+        else:
+            self.write_delta()
+
+    def write_base(self):
+        header = self.builder.state_header()
+        header['base_id'] = uuid4().hex
+        self.builder.save_state(os.path.join(self.directory, BASE), header, durable=True)
+        self.base_id = header['base_id']
+        self.sequence = 0
+        for sequence, path in _deltas(self.directory):
+            os.remove(path)
+        self._mark()
+
+    def write_delta(self):
+        st = self.builder.st
+        header = self.builder.state_header()
+        header.update({'base_id': self.base_id, 'sequence': self.sequence + 1, 'previous': self.sizes})
+        sections = {}
+        for (prefix, size), nodes in zip(TABLES, (st.internal_nodes, st.leaf_nodes)):
+            previous = self.sizes[size]
+            rows = np.array(sorted(row for row in nodes.dirty if row < previous) +
+                            list(range(previous, len(nodes))), dtype=np.int64)
+            sections[f'{prefix}.rows'] = rows
+            for name in nodes.COLUMNS:
+                sections[f'{prefix}.{name}'] = nodes.store.view(name, len(nodes))[rows]
+        sections['data'] = code_view(st.codes)[self.sizes['n_data']:].copy()
+        write_sections(os.path.join(self.directory, DELTA.format(self.sequence + 1)), header, sections, durable=True)
+        self.sequence += 1
+        self._mark()
+
+    @staticmethod
+    def restore(builder_class, directory, trace=False):
+        """(builder, base_id, sequence) of the latest complete checkpoint in directory"""
+        header, tables, codes = builder_class.read_state(os.path.join(directory, BASE))
+        base_id = header['base_id']
+        sequence = 0
+        for delta_sequence, path in _deltas(directory):
+            if delta_sequence != sequence + 1:
+                break
+            try:
+                delta_header, sections, mm = open_sections(path)
+            except (OSError, ValueError):
+                break
+            sizes = {size: header[size] for size in ('n_internal', 'n_leaf', 'n_data')}
+            if delta_header.get('base_id') != base_id or delta_header['previous'] != sizes:
+                break
+            codes = Checkpointer._apply(tables, codes, delta_header, sections)
+            header = delta_header
+            sequence = delta_sequence
+        return builder_class.from_state(header, tables, codes, trace), base_id, sequence
+
+    @staticmethod
+    def _apply(tables, codes, header, sections):
+        typecode = header['typecode']
+        for prefix, size in TABLES:
+            rows = sections[f'{prefix}.rows']
+            for name, column in tables[prefix].items():
+                if len(column) < header[size]:
+                    column.extend(array(typecode, [0]) * (header[size] - len(column)))
+                view = np.frombuffer(column, dtype=np.dtype(typecode))
+                view[rows] = sections[f'{prefix}.{name}']
+                del view
+        data = sections['data']
+        if data.itemsize > 1 and not isinstance(codes, array):
+            codes = array('I', list(codes))
+        codes.extend(data.tobytes() if isinstance(codes, bytearray) else data.tolist())
+        return codes
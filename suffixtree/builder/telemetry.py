@@ -0,0 +1,176 @@
+"""
+Build telemetry and a memory budget, see TreeBuilder.monitor.
+
+Every CLOCK_INTERVAL processed values the monitor reads the resident set size of the process, and
+every `seconds` it writes a JSON line:
+    event               'start', 'progress', then 'done' or 'stopped'
+    time, elapsed       unix time, seconds since monitoring started
+    offset, total       values processed, values in the data source
+    internal, leaf      node counts
+    chars_per_second    over the last `window` seconds
+    rss, table_bytes    resident set size, bytes allocated for the node tables
+    bytes_per_char      RSS growth per value processed since monitoring started
+    projected_rss       RSS when every value is processed at the current bytes_per_char
+    eta_seconds         time left at the current chars_per_second
+    traced              whether a ContextRecorder is attached
+
+The RSS is the whole process, so with trace=True the history of the ContextRecorder is in rss,
+bytes_per_char and projected_rss, and it grows much faster than the node tables.  A memory budget
+or projection is for an untraced build, test.py traces only when given an output file.
+
+With max_memory set, the build stops cleanly once the RSS reaches it, or would reach it when a node
+table doubles within the next CLOCK_INTERVAL values (each value adds at most one leaf and one
+internal node): after the value being processed, with the builder consistent, it writes a
+checkpoint if the builder is checkpointing, a 'stopped' line, and raises MemoryBudgetExceeded with
+that line as its status.  The build can continue from the checkpoint, or from save_state, in a
+process with more memory.
+
+   >>> import io
+   >>> from suffixtree.builder.tree_builder import TreeBuilder
+   >>> out = io.StringIO()
+   >>> tb = TreeBuilder("mississippi$")
+   >>> _ = tb.monitor(out)
+   >>> st = tb.build_tree()
+   >>> lines = [json.loads(line) for line in out.getvalue().splitlines()]
+   >>> [(line['event'], line['offset'], line['leaf'], line['traced']) for line in lines]
+   [('start', 0, 0, False), ('done', 12, 12, False)]
+   >>> tb = TreeBuilder("ab" * 1000 + "$")
+   >>> _ = tb.monitor(max_memory=1)
+   >>> try:
+   ...     tb.build_tree()
+   ... except MemoryBudgetExceeded as stop:
+   ...     stop.status['event'], stop.status['reason'], stop.status['offset'], tb.next_offset_to_process
+   ('stopped', 'max_memory', 1024, 1024)
+"""
+import json
+import os
+import sys
+from collections import deque
+from time import perf_counter, time
+
+CLOCK_INTERVAL = 1024
+SECONDS = 10.0
+WINDOW = 60.0
+UNITS = {'k': 2 ** 10, 'm': 2 ** 20, 'g': 2 ** 30, 't': 2 ** 40}
+
+
+class MemoryBudgetExceeded(Exception):
+    """The build stopped at the memory budget, status is the last telemetry line"""
+
+    def __init__(self, status):
+        super().__init__(f"RSS {status['rss']} reached max_memory {status['max_memory']} "
+                         f"at offset {status['offset']} of {status['total']}")
+        self.status = status
+
+
+def parse_bytes(size):
+    """bytes in a size like 8G, 512m, 1.5g or 1000000"""
+    size = str(size).strip().lower().rstrip('b')
+    if size and size[-1] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+def current_rss():
+    """resident set size of this process in bytes, the peak where the current size is not available"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Telemetry:
+    """Writes the telemetry lines of a builder to out (a path or a text file, None for no lines),
+    every `seconds`, and stops the build at max_memory bytes of RSS"""
+
+    def __init__(self, builder, out=None, seconds=SECONDS, window=WINDOW, max_memory=None):
+        self.builder = builder
+        self.owns_out = isinstance(out, (str, os.PathLike))
+        self.out = open(out, 'a') if self.owns_out else out
+        self.seconds = seconds
+        self.window = window
+        self.max_memory = max_memory
+        self.values = 0
+        self.start_time = perf_counter()
+        self.start_offset = builder.next_offset_to_process
+        self.start_rss = self.rss = current_rss()
+        self.samples = deque([(self.start_time, self.start_offset)])
+        self.last_time = self.start_time
+        self.write('start')
+
+    def after_value(self):
+        """called by the builder after each processed value"""
+        self.values += 1
+        if self.values % CLOCK_INTERVAL:
+            return
+        self.rss = current_rss()
+        now = perf_counter()
+        if self.max_memory is not None and self.rss + self.next_growth() >= self.max_memory:
+            self.stop()
+        if now - self.last_time >= self.seconds:
+            self.write('progress', now)
+
+    def next_growth(self):
+        """bytes the node tables allocate if they fill up within the next CLOCK_INTERVAL values"""
+        growth = 0
+        for nodes in (self.builder.st.internal_nodes, self.builder.st.leaf_nodes):
+            store = nodes.store
+            if len(nodes) + CLOCK_INTERVAL > store.capacity:
+                growth += store.capacity * len(nodes.COLUMNS) * store.dtype.itemsize
+        return growth
+
+    def status(self, event, now=None):
+        """the telemetry line for event, as a dict"""
+        now = perf_counter() if now is None else now
+        st = self.builder.st
+        offset, total = self.builder.next_offset_to_process, len(st.codes)
+        self.samples.append((now, offset))
+        while len(self.samples) > 2 and now - self.samples[1][0] >= self.window:
+            self.samples.popleft()
+        first_time, first_offset = self.samples[0]
+        rate = (offset - first_offset) / (now - first_time) if now > first_time else 0.0
+        processed = offset - self.start_offset
+        bytes_per_char = (self.rss - self.start_rss) / processed if processed else 0.0
+        table_bytes = sum(nodes.store.capacity * len(nodes.COLUMNS) * nodes.store.dtype.itemsize
+                          for nodes in (st.internal_nodes, st.leaf_nodes))
+        return {'event': event, 'time': time(), 'elapsed': now - self.start_time,
+                'offset': offset, 'total': total,
+                'internal': len(st.internal_nodes), 'leaf': len(st.leaf_nodes),
+                'chars_per_second': rate, 'rss': self.rss, 'table_bytes': table_bytes,
+                'bytes_per_char': bytes_per_char,
+                'projected_rss': int(self.rss + bytes_per_char * (total - offset)),
+                'eta_seconds': (total - offset) / rate if rate else None,
+                'max_memory': self.max_memory, 'traced': self.builder.context_recorder is not None}
+
+    def write(self, event, now=None, **fields):
+        status = self.status(event, now)
+        status.update(fields)
+        self.last_time = perf_counter() if now is None else now
+        if self.out is not None:
+            self.out.write(json.dumps(status) + '\n')
+            self.out.flush()
+        return status
+
+    def stop(self):
+        checkpoint = None
+        checkpointer = self.builder.checkpointer
+        if checkpointer is not None:
+            checkpointer.checkpoint()
+            checkpoint = checkpointer.directory
+        status = self.write('stopped', reason='max_memory', checkpoint=checkpoint)
+        self.close()
+        raise MemoryBudgetExceeded(status)
+
+    def finish(self):
+        """called by the builder when every value is processed"""
+        self.rss = current_rss()
+        self.write('done')
+        self.close()
+
+    def close(self):
+        if self.owns_out:
+            self.out.close()
+            self.out = None
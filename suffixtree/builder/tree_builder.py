@@ -1,7 +1,7 @@
 """
 Test Basic Building, Saving, Loading a Suffix Tree
 
-   >>> tb = TreeBuilder("mississippi$", size_limit=100)
+   >>> tb = TreeBuilder("mississippi$", initial_capacity=4)
    >>> st = tb.build_tree()
    >>> print(st.info())
    12 leaf nodes, 7 internal nodes
@@ -25,35 +25,60 @@ Test Basic Building, Saving, Loading a Suffix Tree
        si  p.1 sl.4 (iESO=3, iEEO=5, iESV='s') .3.
          ssippi$ p.3 (iESO=5, iESV='s') -2-
          ppi$ p.3 (iESO=8, iESV='p') -5-
+   >>> location = Location()
+   >>> location.internal_node(st.internal_nodes.edge(5))
+   >>> st.get_suffixes(location).tolist()
+   [10, 7, 4, 1]
+   >>> list(st.iter_suffixes(location, limit=2))
+   [10, 7]
+   >>> location.internal_node(st.root_edge)
+   >>> st.get_suffixes(location).tolist()
+   [11, 10, 7, 4, 1, 0, 9, 8, 6, 3, 5, 2]
+   >>> sa, lcp = st.to_suffix_array()
+   >>> sa.tolist()
+   [11, 10, 7, 4, 1, 0, 9, 8, 6, 3, 5, 2]
+   >>> lcp.tolist()
+   [0, 0, 1, 1, 4, 0, 0, 1, 0, 2, 1, 3]
+   >>> [st.internal_nodes.sD[node] for node in range(len(st.internal_nodes))]
+   [0, 1, 4, 3, 2, 1, 1]
+   >>> location.internal_edge(st.internal_nodes.edge(2), 2)
+   >>> st.location_depth(location), st.depth_exceeds_limit(2, 3), st.depth_exceeds_limit(2, 3, 2)
+   (3, True, False)
+
+A build can be saved half way and continued in another process:
+
+   >>> import os, tempfile
+   >>> tb = TreeBuilder("missis")
+   >>> _ = tb.build_tree()
+   >>> path = os.path.join(tempfile.mkdtemp(), 'mississippi.state')
+   >>> tb.save_state(path)
+   >>> tb = TreeBuilder.resume(path)
+   >>> tb.extend("sippi$")
+   >>> st = tb.build_tree()
+   >>> print(st.info())
+   12 leaf nodes, 7 internal nodes
+   >>> st.find_all("issi").tolist()
+   [4, 1]
    >>>
 
 """
-from suffixtree.tree_nodes import LeafNodes, leaf_df, InternalNodes, empty_internal_df
+from array import array
+
+from suffixtree.tree_nodes import LeafNodes, InternalNodes, ArrayColumns, typecode_for
+from suffixtree.mapped_file import write_sections, open_sections
+from suffixtree.builder.checkpoint import Checkpointer, COMPACT_AFTER
+from suffixtree.builder.telemetry import Telemetry, SECONDS, WINDOW
+from data_source.codes import code_encoding, code_view
 from suffixtree.location import Location
-from suffixtree.suffixtree import SuffixTree, Edge
+from suffixtree.suffixtree import SuffixTree
+from suffixtree.sequences import SequenceMap
 from collections import defaultdict, namedtuple
 from collections import deque
-from functools import wraps
 from copy import copy
-from time import perf_counter
-
-
-def state_recorder(fn):
-    @wraps(fn)
-    def inner(context):
-        if context.builder:
-            context.builder.register_before(fn.__name__)
-        #print(f'{fn.__name__.upper()}({context.offset}, {context.value}) {context.location}')
-        fn(context)
-        if context.builder:
-            context.builder.register_after(fn.__name__)
 
-    return inner
 
-
-@state_recorder
 def _add_leaf(context):
-    context.st.leaf_nodes.add(context.location.internal_node_id, context.offset, ord(context.value))
+    context.st.leaf_nodes.add(context.location.internal_node_id, context.offset, context.value)
 
 
 def fix_suffix_link(context, new_node):
@@ -61,91 +86,98 @@ def fix_suffix_link(context, new_node):
         context.st.internal_nodes.set_suffix_link(context.needs_suffix_link, new_node)
         context.needs_suffix_link = None
 
-@state_recorder
 def _split_leaf_edge(context):
     location = context.location
-    edge = context.st.leaf_nodes.data.iloc[location.leaf_node_id]
-    new_internal_node = context.st.internal_nodes.add_node(edge.parent,
-                                                           edge.iESO,
-                                                           edge.iESV,
-                                                           edge.iESO + location.incoming_edge_offset)
+    leaf_nodes = context.st.leaf_nodes
+    internal_nodes = context.st.internal_nodes
+    leaf = location.leaf_node_id
+    parent = leaf_nodes.parent[leaf]
+    iESO = leaf + internal_nodes.sD[parent]
+    new_iESO = iESO + location.incoming_edge_offset
+    new_internal_node = internal_nodes.add_node(parent, iESO, context.codes[iESO], new_iESO)
     fix_suffix_link(context, new_internal_node)
-    new_iESO = edge.iESO + location.incoming_edge_offset
-    new_iESV = ord(context.data_source[int(new_iESO)])
-    context.st.leaf_nodes.update_leaf_child(location.leaf_node_id, new_internal_node, new_iESO, new_iESV)
-    context.location.internal_node(Edge(context.st.internal_nodes[new_internal_node]))
+    new_iESV = context.codes[new_iESO]
+    leaf_nodes.update_leaf_child(leaf, new_internal_node, new_iESO, new_iESV)
+    location.internal_node(internal_nodes.edge(new_internal_node))
 
 
-@state_recorder
 def _split_internal_edge(context):
     location = context.location
-    edge = context.st.internal_nodes.data.iloc[location.internal_node_id]
-    new_internal_node = context.st.internal_nodes.add_node(edge.parent,
-                                                           edge.iESO,
-                                                           edge.iESV,
-                                                           edge.iESO + location.incoming_edge_offset)
+    internal_nodes = context.st.internal_nodes
+    node = location.internal_node_id
+    iESO = internal_nodes.iESO[node]
+    new_iESO = iESO + location.incoming_edge_offset
+    new_internal_node = internal_nodes.add_node(internal_nodes.parent[node], iESO, internal_nodes.iESV[node], new_iESO)
     fix_suffix_link(context, new_internal_node)
-    new_iESO = edge.iESO + location.incoming_edge_offset
-    new_iESV = ord(context.data_source[int(new_iESO)])
-    context.st.internal_nodes.update_internal_child(location.internal_node_id, new_internal_node, new_iESO, new_iESV)
-    context.location.internal_node(Edge(context.st.internal_nodes[new_internal_node]))
+    new_iESV = context.codes[new_iESO]
+    internal_nodes.update_internal_child(node, new_internal_node, new_iESO, new_iESV)
+    location.internal_node(internal_nodes.edge(new_internal_node))
 
 
-@state_recorder
 def _skip_count_down(context):
-    while context.edge_value:
-        first_value = ord(context.edge_value[0])
-        edge = context.st.find_edge(context.location.internal_node_id, first_value)
+    """descend skip_length values of codes, from skip_start, below the location's node,
+    one hop per edge: the values are in the tree, only the first of each edge is compared"""
+    codes, location = context.codes, context.location
+    start, k = context.skip_start, context.skip_length
+    while k:
+        edge = context.st.find_edge(location.internal_node_id, codes[start])
         if edge is None:
-            raise ValueError(f"{context.location}, cannot find {context.edge_value[0]}")
+            raise ValueError(f"{location}, cannot find {chr(codes[start])}")
+        context.hops += 1
         if edge.is_internal:
-            if len(edge) <= len(context.edge_value):
-                context.location.internal_node(edge)
-                context.edge_value = context.edge_value[len(edge):]
-                if not context.edge_value:
-                    if context.needs_suffix_link:
-                        context.st.internal_nodes.set_suffix_link(context.needs_suffix_link, edge.id)
-                        context.needs_suffix_link = None
+            length = len(edge)
+            if length <= k:
+                location.internal_node(edge)
+                start += length
+                k -= length
+                if not k and context.needs_suffix_link:
+                    context.st.internal_nodes.set_suffix_link(context.needs_suffix_link, edge.id)
+                    context.needs_suffix_link = None
             else:
-                context.location.internal_edge(edge, len(context.edge_value))
-                context.edge_value = ""
+                location.internal_edge(edge, k)
+                k = 0
         else:
-            context.location.leaf_edge(edge, len(context.edge_value))
-            context.edge_value = ""
+            location.leaf_edge(edge, k)
+            k = 0
+    context.skip_start = context.skip_length = 0
 
     context.q.append(_traverse_value)
 
-@state_recorder
 def _goto_suffix(context):
     location = context.location
+    internal_nodes = context.st.internal_nodes
     if location.on_internal_node:
-        if location.internal_node_id != context.st.internal_nodes.root:
-            internal_row = context.st.internal_nodes[location.internal_node_id]
-            if internal_row.sL != -1:
-                location.internal_node(Edge(context.st.internal_nodes[internal_row.sL]))
+        node = location.internal_node_id
+        if node != internal_nodes.root:
+            suffix_link = internal_nodes.sL[node]
+            if suffix_link != -1:
+                location.internal_node(internal_nodes.edge(suffix_link))
                 context.q.appendleft(_traverse_value)
             else:
-                context.needs_suffix_link = location.internal_node_id
-                edge_value = context.data_source[internal_row.iESO:internal_row.iEEO]
-                parent_row = context.st.internal_nodes[internal_row.parent]
-                if internal_row.parent == context.st.internal_nodes.root:
-                    edge_value = edge_value[1:]
-                if edge_value:
-                    context.edge_value = edge_value
-                    context.location.internal_node(Edge(context.st.internal_nodes[parent_row.sL]))
+                context.needs_suffix_link = node
+                # the incoming edge of node, less its first value below the root, is skip/counted
+                # down from the suffix link of the parent, as offsets into codes
+                start = internal_nodes.iESO[node]
+                length = internal_nodes.iEEO[node] - start
+                parent = internal_nodes.parent[node]
+                if parent == internal_nodes.root:
+                    start += 1
+                    length -= 1
+                if length:
+                    context.skip_start, context.skip_length = start, length
+                    location.internal_node(internal_nodes.edge(internal_nodes.sL[parent]))
                     context.q.appendleft(_skip_count_down)
                 else:
-                    context.st.internal_nodes.set_suffix_link(location.internal_node_id, context.st.internal_nodes.root)
+                    internal_nodes.set_suffix_link(node, internal_nodes.root)
                     context.needs_suffix_link = None
-                    location.internal_node(Edge(context.st.root_node))
+                    location.internal_node(context.st.root_edge)
                     context.q.appendleft(_traverse_value)
 
 
-@state_recorder
 def _traverse_value(context):
     location = context.location
     if location.on_edge:
-        if context.data_source[location.offset] == context.value:
+        if context.codes[location.offset] == context.value:
             location.down(context.st.edge(location.internal_node_id, location.leaf_node_id))
             context.succeeded = True
         elif context.building:
@@ -156,7 +188,7 @@ def _traverse_value(context):
             context.q.append(_add_leaf)
             context.q.append(_goto_suffix)
     else:
-        edge = context.st.find_edge(location.internal_node_id, ord(context.value))
+        edge = context.st.find_edge(location.internal_node_id, context.value)
         if edge is not None:
             location.update(edge)
             context.succeeded = True
@@ -167,29 +199,48 @@ def _traverse_value(context):
 
 class ValueProcessor:
     def __init__(self, st, location, data_source, builder=None):
+        """process() takes integer codes, compared against st.codes"""
         self.st = st
         self.location = location
         self.data_source = data_source
+        self.codes = st.codes
         self.offset = None
         self.value = None
         self.needs_suffix_link = None
+        # the values _skip_count_down descends: skip_length of them from offset skip_start in codes
+        self.skip_start = 0
+        self.skip_length = 0
         self.q = deque()
         self.building = (builder is not None)
         self.builder = builder
         self.succeeded = False
+        # edges descended by _skip_count_down, read by suffixtree.profiler
+        self.hops = 0
+
+        # observers see every rule, see TreeBuilder.attach
+        self.observers = []
 
     def process(self, offset, value):
         self.offset = offset
         self.value = value
         self.q.append(_traverse_value)
+        if self.observers:
+            return self._process_observed()
+        q = self.q
+        while q:
+            fn = q.popleft()
+            self.succeeded = False
+            fn(self)
+
+    def _process_observed(self):
         while self.q:
-            fnstart = perf_counter()
             fn = self.q.popleft()
             self.succeeded = False
+            for observer in self.observers:
+                observer.before_rule(fn, self)
             fn(self)
-            fnend = perf_counter()
-            # print(f"    {fn.__name__}: {fnend - fnstart:.2f}")
-            # self.builder.show_tree(f"After {fn.__name__}({offset}, {value})", indent=True)
+            for observer in self.observers:
+                observer.after_rule(fn, self)
 
 
 
@@ -207,6 +258,7 @@ def ndiff(title, before, after):
 
 
 class ContextRecorder:
+    """Build observer recording the location and node counts around every rule, for the golden files in tests/"""
     def __init__(self):
         self.before_steps = []
         self.after_steps = []
@@ -215,7 +267,13 @@ class ContextRecorder:
 
     def step_processing(self, offset, value):
         self.current_offset = offset
-        self.current_value = value
+        self.current_value = chr(value)
+
+    def before_rule(self, fn, context):
+        self.before(fn.__name__, copy(context.location), len(context.st.internal_nodes), len(context.st.leaf_nodes))
+
+    def after_rule(self, fn, context):
+        self.after(fn.__name__, copy(context.location), len(context.st.internal_nodes), len(context.st.leaf_nodes))
 
     def before(self, fn_name, location, number_internal_nodes, number_leaf_nodes):
         self.before_steps.append(TreeState(fn_name, self.current_offset, self.current_value, location,
@@ -250,37 +308,181 @@ def indent_lines(indent_flag, text):
 
 
 class TreeBuilder:
-    SIZE_LIMIT = 10_000_000
-
-    def __init__(self, data_source, size_limit=SIZE_LIMIT):
-        internal_nodes = InternalNodes(empty_internal_df(size_limit), next_idx=1, data_source=data_source)
-        leaf_nodes = LeafNodes(leaf_df(size_limit), next_idx=0, data_source=data_source, next_offset_to_process=0)
-        self.st = SuffixTree(internal_nodes, leaf_nodes, data_source)
-        self.data_source = data_source
+    INITIAL_CAPACITY = 1024
+    STATE_VERSION = 2
+
+    def __init__(self, data_source, initial_capacity=INITIAL_CAPACITY, backend='array', trace=False):
+        """backend is 'array' (typed columns) or 'dataframe' (the original pandas storage).
+        Node tables start with room for initial_capacity rows and double as needed.
+        trace attaches a ContextRecorder, otherwise nothing is recorded on the build path."""
+        typecode = typecode_for(len(data_source))
+        internal_nodes = InternalNodes.allocate(initial_capacity, data_source, backend, typecode)
+        leaf_nodes = LeafNodes.allocate(initial_capacity, data_source, backend, typecode)
+        self._start(SuffixTree(internal_nodes, leaf_nodes, data_source), trace)
+
+    def _start(self, st, trace):
+        st.leaf_nodes.next_offset_to_process = 0
+        self.st = st
+        self.data_source = st.data_source
         self.location = Location()
-        self.location.internal_node(Edge(self.st.root_node))
+        self.location.internal_node(self.st.root_edge)
         self.next_offset_to_process = 0
         self.create_node_data = defaultdict(list)
         self.node_needing_suffix_link = None
-        self.context_recorder = ContextRecorder()
         self.value_processor = ValueProcessor(self.st, self.location, self.data_source, self)
-
-    def register_before(self, fn_name):
-        self.context_recorder.before(fn_name, copy(self.location), len(self.st.internal_nodes), len(self.st.leaf_nodes))
-
-    def register_after(self, fn_name):
-        self.context_recorder.after(fn_name, copy(self.location), len(self.st.internal_nodes), len(self.st.leaf_nodes))
+        self.observers = self.value_processor.observers
+        self.context_recorder = None
+        if trace:
+            self.context_recorder = ContextRecorder()
+            self.attach(self.context_recorder)
+        self.checkpointer = None
+        self.telemetry = None
+
+    @classmethod
+    def from_sequences(cls, sequences, names=None, **kwargs):
+        """Builder of a generalized tree over many sequences, each ended by its own separator,
+        see suffixtree.sequences.  The tree reports suffixes as (name, position) pairs."""
+        data_source, sequence_map = SequenceMap.concatenate(sequences, names)
+        builder = cls(data_source, **kwargs)
+        builder.st.sequences = sequence_map
+        return builder
+
+    def attach(self, observer):
+        """Add a build observer, it is called with
+            step_processing(offset, value) before every value,
+            before_rule(fn, value_processor) and after_rule(fn, value_processor) around every rule"""
+        self.observers.append(observer)
+
+    def detach(self, observer):
+        self.observers.remove(observer)
 
     def build_tree(self):
-        for offset, value in enumerate(self.data_source):
+        """Process every value not processed yet, returns the finalized tree"""
+        start = self.next_offset_to_process
+        for offset, value in enumerate(self.st.codes[start:], start):
             self.process_value(offset, value)
+        self.st.finalize()
+        if self.telemetry is not None:
+            self.telemetry.finish()
         return self.st
 
+    def append_data(self, data):
+        """Append text to the data source without processing it yet"""
+        self.st.append_data(data)
+        self.data_source = self.value_processor.data_source = self.st.data_source
+        self.value_processor.codes = self.st.codes
+
+    def extend(self, data):
+        """Append text to the data source and continue the online construction with it.
+        A tree is only complete once the data ends with a terminator, see build_tree."""
+        self.append_data(data)
+        start = self.next_offset_to_process
+        for offset, value in enumerate(self.st.codes[start:], start):
+            self.process_value(offset, value)
+
+    def state_header(self):
+        """the builder state (active location, next offset, pending suffix link) and table sizes"""
+        st, location = self.st, self.location
+        if location.on_internal_node:
+            active = ['node', location.internal_node_id, 0]
+        elif location.on_internal_edge:
+            active = ['internal_edge', location.internal_node_id, location.incoming_edge_offset]
+        else:
+            active = ['leaf_edge', location.leaf_node_id, location.incoming_edge_offset]
+        header = {'state_version': self.STATE_VERSION, 'typecode': st.internal_nodes.store.typecode,
+                  'encoding': code_encoding(st.codes), 'n_internal': len(st.internal_nodes),
+                  'n_leaf': len(st.leaf_nodes), 'n_data': len(st.codes),
+                  'next_offset_to_process': self.next_offset_to_process,
+                  'needs_suffix_link': self.value_processor.needs_suffix_link, 'location': active}
+        if st.sequences is not None:
+            header['sequences'] = st.sequences.to_header()
+        return header
+
+    def save_state(self, path, header=None, durable=False):
+        """Write the node tables, the data and the builder state (active location, next offset,
+        pending suffix link) to path, so the build can continue later in another process, see resume"""
+        sections = self.st.node_sections()
+        sections['data'] = code_view(self.st.codes)
+        write_sections(path, header or self.state_header(), sections, durable)
+
+    @classmethod
+    def read_state(cls, path):
+        """(header, {'internal': columns, 'leaf': columns}, codes) of a save_state file, as writable arrays"""
+        header, sections, mm = open_sections(path)
+        if header.get('state_version') != cls.STATE_VERSION:
+            raise ValueError(f"{path} is not a builder state file of version {cls.STATE_VERSION}")
+        typecode = header['typecode']
+        tables = {prefix: {name: array(typecode, sections[f'{prefix}.{name}'].tobytes()) for name in nodes.COLUMNS}
+                  for prefix, nodes in (('internal', InternalNodes), ('leaf', LeafNodes))}
+        data = sections['data']
+        codes = bytearray(data.tobytes()) if data.itemsize == 1 else array('I', data.tolist())
+        return header, tables, codes
+
+    @classmethod
+    def resume(cls, path, trace=False):
+        """Builder restored from a save_state file, continue it with extend and build_tree"""
+        return cls.from_state(*cls.read_state(path), trace=trace)
+
+    @classmethod
+    def from_state(cls, header, tables, codes, trace=False):
+        """Builder over node table columns and a code array, in the state recorded in header"""
+        typecode = header['typecode']
+        data_source = codes.decode('latin-1') if isinstance(codes, bytearray) else ''.join(map(chr, codes))
+        internal_nodes = InternalNodes(ArrayColumns(tables['internal'], typecode), header['n_internal'], data_source)
+        leaf_nodes = LeafNodes(ArrayColumns(tables['leaf'], typecode), header['n_leaf'], data_source)
+        st = SuffixTree(internal_nodes, leaf_nodes, data_source, codes=codes)
+        if 'sequences' in header:
+            st.sequences = SequenceMap.from_header(header['sequences'])
+        builder = cls.__new__(cls)
+        builder._start(st, trace)
+        builder.next_offset_to_process = header['next_offset_to_process']
+        builder.value_processor.needs_suffix_link = header['needs_suffix_link']
+        kind, node, edge_offset = header['location']
+        if kind == 'node':
+            builder.location.internal_node(internal_nodes.edge(node))
+        elif kind == 'internal_edge':
+            builder.location.internal_edge(internal_nodes.edge(node), edge_offset)
+        else:
+            builder.location.leaf_edge(leaf_nodes.edge(node), edge_offset)
+        return builder
+
+    def checkpoint_every(self, directory, values=None, seconds=None, compact_after=COMPACT_AFTER):
+        """Checkpoint the build to directory every `values` processed values and/or every `seconds`,
+        starting with a full checkpoint now, see suffixtree.builder.checkpoint"""
+        self.checkpointer = Checkpointer(self, directory, values, seconds, compact_after)
+        self.checkpointer.write_base()
+
+    def monitor(self, out=None, seconds=SECONDS, window=WINDOW, max_memory=None):
+        """Write build telemetry as JSON lines to out (a path or a text file) every `seconds`,
+        and stop the build with MemoryBudgetExceeded once the RSS reaches max_memory bytes,
+        see suffixtree.builder.telemetry"""
+        self.telemetry = Telemetry(self, out, seconds, window, max_memory)
+        return self.telemetry
+
+    @classmethod
+    def restore(cls, directory, values=None, seconds=None, trace=False):
+        """Builder at the latest complete checkpoint in directory, checkpointing on
+        to the same directory if values or seconds is given"""
+        builder, base_id, sequence = Checkpointer.restore(cls, directory, trace)
+        if values or seconds:
+            builder.checkpointer = Checkpointer(builder, directory, values, seconds)
+            builder.checkpointer.base_id = base_id
+            builder.checkpointer.sequence = sequence
+        return builder
+
     def process_value(self, offset, value):
+        """value is the code at offset, or its character"""
         #self.show_tree(f"About to process: ({offset}, {value})")
+        if isinstance(value, str):
+            value = ord(value)
         self.next_offset_to_process = offset + 1
-        self.context_recorder.step_processing(offset, value)
+        for observer in self.observers:
+            observer.step_processing(offset, value)
         self.value_processor.process(offset, value)
+        if self.checkpointer is not None:
+            self.checkpointer.after_value()
+        if self.telemetry is not None:
+            self.telemetry.after_value()
 
     def show_tree(self, title=None, indent=False):
         self.st.leaf_nodes.next_offset_to_process = self.next_offset_to_process
@@ -294,7 +496,8 @@ class TreeBuilder:
         print(indent_lines(indent,
                            f"{self.data_source[:self.next_offset_to_process]}^{self.data_source[self.next_offset_to_process:]}"))
         print(indent_lines(indent, f"{self.location}"))
-        print(indent_lines(indent, f"{self.context_recorder}"))
+        if self.context_recorder:
+            print(indent_lines(indent, f"{self.context_recorder}"))
 
 #
 # if __name__ == "__main__":
@@ -0,0 +1,187 @@
+"""Child lookup index: (parent internal node, first value of edge) -> child
+
+Internal children are stored as their node id (always > 0, the root is never a child),
+leaf children as ~leaf_id (always < 0), so one lookup answers for both node tables.
+
+   >>> index = ChildIndex.for_values(map(ord, "ACGT$"))
+   >>> index.add(0, ord('A'), 3)
+   >>> index.add(3, ord('$'), ~7)
+   >>> index.get(0, ord('A')), index.get(3, ord('$')), index.get(3, ord('A')), index.get(3, ord('x'))
+   (3, -8, None, None)
+   >>> type(ChildIndex.for_values(range(1000))).__name__
+   'HashChildIndex'
+
+A HashChildIndex is saved as a flat open-addressing table, which a mapped tree probes in place:
+
+   >>> index = ChildIndex.for_values(range(1000))
+   >>> for parent, value, child in ((0, 500, 3), (3, 7, ~7), (3, 999, 4), (4, 0, ~9)):
+   ...     index.add(parent, value, child)
+   >>> header, sections = index.to_sections()
+   >>> mapped = ChildIndex.from_sections(header, sections)
+   >>> type(mapped).__name__, [mapped.get(*key) for key in ((0, 500), (3, 7), (3, 999), (4, 0), (3, 8), (5, 7))]
+   ('MappedHashChildIndex', [3, -8, 4, -10, None, None])
+"""
+from array import array
+
+import numpy as np
+
+from suffixtree.tree_nodes import edge_columns
+
+EMPTY = 0
+VALUE_BITS = 21    # enough for any unicode code point
+# open-addressing table of a saved HashChildIndex: Fibonacci hashing of the packed key, linear probing
+EMPTY_KEY = -1
+MULTIPLIER = 0x9E3779B97F4A7C15
+MASK64 = (1 << 64) - 1
+
+
+class ChildIndex:
+    SLOT_ALPHABET_LIMIT = 16
+
+    @staticmethod
+    def for_values(values, typecode='q'):
+        """Alphabet-indexed slots for small alphabets (DNA), hashed otherwise.
+        typecode is the array typecode of the slots, wide enough for any node id"""
+        values = sorted(set(values))
+        if len(values) <= ChildIndex.SLOT_ALPHABET_LIMIT:
+            return SlotChildIndex(values, typecode)
+        return HashChildIndex()
+
+    @staticmethod
+    def from_sections(header, sections):
+        """the index saved by to_sections, None if it was not saved and has to be rebuilt"""
+        if 'alphabet' in header:
+            slots = sections['children.slots']
+            index = SlotChildIndex(header['alphabet'], slots.dtype.char)
+            index.slots = memoryview(slots)
+            return index
+        if 'children.keys' in sections:
+            return MappedHashChildIndex(sections['children.keys'], sections['children.values'])
+        return None
+
+    def covers(self, values):
+        """True if edges starting with any of values can be added"""
+        return True
+
+    def rebuild(self, internal_nodes, leaf_nodes):
+        """index every edge already in the node tables (the root row is not an edge)"""
+        parents, values, children = edge_columns(internal_nodes, leaf_nodes)
+        self.add_all(parents, values, children, len(internal_nodes))
+
+
+class SlotChildIndex(ChildIndex):
+    """One row of len(alphabet) child slots per internal node"""
+
+    def __init__(self, values, typecode='q'):
+        self.values = list(values)
+        self.slot_of = {value: slot for slot, value in enumerate(self.values)}
+        self.width = len(self.values)
+        self.typecode = typecode
+        self.slots = array(typecode)
+
+    def add(self, parent, value, child):
+        idx = parent * self.width + self.slot_of[value]
+        if idx >= len(self.slots):
+            self.slots.extend(array(self.typecode, [EMPTY]) * max(idx + 1 - len(self.slots), len(self.slots)))
+        self.slots[idx] = child
+
+    def covers(self, values):
+        return all(value in self.slot_of for value in values)
+
+    def get(self, parent, value):
+        slot = self.slot_of.get(value)
+        if slot is None:
+            return None
+        idx = parent * self.width + slot
+        if idx >= len(self.slots):
+            return None
+        child = self.slots[idx]
+        return None if child == EMPTY else child
+
+    def add_all(self, parents, values, children, n_internal):
+        lookup = np.full(max(self.values, default=0) + 1, -1, dtype=np.int64)
+        lookup[self.values] = np.arange(self.width)
+        table = np.zeros(n_internal * self.width, dtype=np.dtype(self.typecode))
+        table[parents * self.width + lookup[values]] = children
+        self.slots = array(self.typecode, table.tobytes())
+
+    def to_sections(self):
+        return {'alphabet': self.values}, {'children.slots': np.asarray(self.slots)}
+
+
+class HashChildIndex(ChildIndex):
+    """dict keyed by parent and value packed into one int"""
+
+    def __init__(self):
+        self.children = {}
+
+    def add(self, parent, value, child):
+        self.children[(parent << VALUE_BITS) | value] = child
+
+    def get(self, parent, value):
+        return self.children.get((parent << VALUE_BITS) | value)
+
+    def add_all(self, parents, values, children, n_internal):
+        self.children.update(zip(((parents << VALUE_BITS) | values).tolist(), children.tolist()))
+
+    def to_sections(self):
+        keys = np.fromiter(self.children.keys(), dtype=np.int64, count=len(self.children))
+        children = np.fromiter(self.children.values(), dtype=np.int64, count=len(self.children))
+        table_keys, table_children = _open_addressing(keys, children)
+        return {}, {'children.keys': table_keys, 'children.values': table_children}
+
+
+def _slots(keys, bits):
+    """home slot of every packed key in a table of 2 ** bits slots"""
+    return ((keys.astype(np.uint64) * np.uint64(MULTIPLIER)) >> np.uint64(64 - bits)).astype(np.int64)
+
+
+def _open_addressing(keys, children):
+    """(keys, children) columns of a linear probing table at most half full, EMPTY_KEY in free slots.
+    Every round places one key in each free slot asked for, the keys left over probe the next slot"""
+    bits = max(int(2 * len(keys)).bit_length(), 1)
+    mask = (1 << bits) - 1
+    table_keys = np.full(1 << bits, EMPTY_KEY, dtype=np.int64)
+    table_children = np.zeros(1 << bits, dtype=np.int64)
+    slots = _slots(keys, bits)
+    pending = np.arange(len(keys))
+    while len(pending):
+        free = table_keys[slots[pending]] == EMPTY_KEY
+        taken, first = np.unique(slots[pending[free]], return_index=True)
+        placed = pending[free][first]
+        table_keys[taken] = keys[placed]
+        table_children[taken] = children[placed]
+        is_placed = np.zeros(len(keys), dtype=bool)
+        is_placed[placed] = True
+        pending = pending[~is_placed[pending]]
+        slots[pending] = (slots[pending] + 1) & mask
+    return table_keys, table_children
+
+
+class MappedHashChildIndex(ChildIndex):
+    """the open-addressing table a HashChildIndex is saved as, probed in place (read-only)"""
+
+    def __init__(self, keys, children):
+        self.keys = memoryview(keys)
+        self.children = memoryview(children)
+        self.mask = len(keys) - 1
+        self.shift = 64 - self.mask.bit_length()
+
+    def covers(self, values):
+        """nothing can be added, a tree that grows rebuilds its index"""
+        return False
+
+    def get(self, parent, value):
+        key = (parent << VALUE_BITS) | value
+        slot = ((key * MULTIPLIER) & MASK64) >> self.shift
+        keys = self.keys
+        while True:
+            found = keys[slot]
+            if found == key:
+                return self.children[slot]
+            if found == EMPTY_KEY:
+                return None
+            slot = (slot + 1) & self.mask
+
+    def to_sections(self):
+        return {}, {'children.keys': np.asarray(self.keys), 'children.values': np.asarray(self.children)}
@@ -0,0 +1,207 @@
+"""
+k-mer jump table of a finished SuffixTree: the tree location reached after reading each k-mer,
+so a search starts at depth k with one lookup instead of walking k values down from the root.
+
+Every k-mer of the text ends on exactly one edge, the edge from a node of string depth < k to a node
+of string depth >= k, so the table maps the k-mer to the ChildIndex code of that child (~leaf for a leaf).
+The depth-k location is k - sD[parent] values down its incoming edge.  The table is built from one
+pass over the edges (an occurrence of the edge label is read from the text), at finalize time when
+SuffixTree.kmer_k is set, and saved with the tree, see SuffixTree.save_mapped and KmerTable.save.
+
+Two kinds:
+    dense   an array of sigma ** k entries indexed by the k-mer as a base-sigma number, for small
+            alphabets: DNA (ACGT, k up to 12 is 16M entries) or any alphabet of a few symbols.
+            k-mers with values outside the alphabet (N, separators, the terminator) are not in it.
+    hashed  a dict from the k-mer's code bytes, for larger alphabets, built from the saved key rows
+            on the first lookup.  Only the k-mers of the text are stored.
+
+lookup(pattern) answers for the first k values of pattern: the ChildIndex code, ABSENT when the
+k-mer does not occur in the text, None when the table cannot tell (a shorter pattern, values outside
+a dense alphabet) and the caller walks from the root as before.
+
+   >>> from suffixtree.builder.tree_builder import TreeBuilder
+   >>> st = TreeBuilder("mississippi$").build_tree()
+   >>> kmers = KmerTable.build(st, 2)
+   >>> kmers.kind, kmers.alphabet, len(kmers)
+   ('dense', [36, 105, 109, 112, 115], 25)
+   >>> [kmers.lookup(to_codes(kmer)) for kmer in ("ss", "si", "is", "ssi", "sm", "s", "sx")]
+   [3, 4, 2, 3, 0, None, None]
+   >>> hashed = KmerTable.build(st, 2, dense=False)
+   >>> hashed.kind, len(hashed), [hashed.lookup(to_codes(kmer)) for kmer in ("ss", "si", "sm", "sx", "pi", "i$")]
+   ('hashed', 8, [3, 4, 0, 0, -10, -11])
+"""
+from array import array
+
+import numpy as np
+
+from data_source.codes import to_codes, code_view
+from suffixtree.mapped_file import write_sections, open_sections
+
+ABSENT = 0
+DNA = b'ACGT'
+# entries of a dense table, 4 ** 12
+DENSE_LIMIT = 1 << 24
+# at most this many entries per text value, a bigger dense table is mostly empty and a hashed one is smaller
+DENSE_PER_VALUE = 32
+# fraction of the text in the DNA alphabet for a dense ACGT table, the rest (N, separators) is walked
+DNA_SHARE = 0.99
+DIGITS = b'0123456789abcdefghijklmnopqrstuvwxyz'
+NOT_A_DIGIT = ord('!')
+
+
+def _edges_at_depth(st, k):
+    """(ChildIndex code, text offset of one occurrence of the path label) of every edge reaching depth k"""
+    if not st.finalized:
+        st.finalize()
+    internal_nodes, leaf_nodes = st.internal_nodes, st.leaf_nodes
+    n_internal, n_leaf = len(internal_nodes), len(leaf_nodes)
+    sD = internal_nodes.store.view('sD', n_internal).astype(np.int64)
+    parent = internal_nodes.store.view('parent', n_internal).astype(np.int64)
+    nodes = np.arange(1, n_internal)
+    nodes = nodes[(sD[parent[nodes]] < k) & (sD[nodes] >= k)]
+    first_leaf = np.asarray(internal_nodes.first_leaf[:n_internal], dtype=np.int64)
+    occurrences = np.asarray(st.positions, dtype=np.int64)[first_leaf[nodes]]
+
+    leaf_parent = leaf_nodes.store.view('parent', n_leaf).astype(np.int64)
+    leaves = np.arange(n_leaf)
+    leaves = leaves[(sD[leaf_parent] < k) & (len(st.codes) - leaves >= k)]
+    return np.concatenate((nodes, ~leaves)), np.concatenate((occurrences, leaves))
+
+
+def _narrow(window):
+    """a code array as bytes, None if it has codes above 255"""
+    try:
+        return bytes(memoryview(window).tolist())
+    except ValueError:
+        return None
+
+
+class KmerTable:
+    """ChildIndex code of the depth-k location of every k-mer of a tree, dense or hashed"""
+
+    def __init__(self, k, values, alphabet=None, keys=None, itemsize=1):
+        """values[index] for a dense table over alphabet (codes, their rank is the digit),
+        values[row] for the k-mer in keys[row * k:(row + 1) * k] of a hashed one"""
+        self.k = k
+        self.values = values
+        self.slots = memoryview(values)
+        self.alphabet = alphabet
+        self.keys = keys
+        self.itemsize = itemsize
+        self.index = None
+        # translation of the alphabet codes to base-sigma digits, for int() to read the dense index
+        self.digits = None
+        if alphabet is not None:
+            digits = bytearray([NOT_A_DIGIT]) * 256
+            for rank, code in enumerate(alphabet):
+                digits[code] = DIGITS[rank]
+            self.digits = bytes(digits)
+            self.base = len(alphabet)
+
+    @property
+    def kind(self):
+        return 'hashed' if self.alphabet is None else 'dense'
+
+    def __len__(self):
+        return len(self.values)
+
+    @classmethod
+    def build(cls, st, k, dense=None):
+        """Table of the k-mers of a tree, dense when the alphabet allows it (or dense=True asks for it)"""
+        if k < 1:
+            raise ValueError(f"k must be at least 1, not {k}")
+        text = code_view(st.codes)
+        alphabet = None if dense is False else cls._dense_alphabet(text, k)
+        if dense and alphabet is None:
+            raise ValueError(f"no dense table of {k}-mers over this alphabet, at most {DENSE_LIMIT} entries")
+        loci, occurrences = _edges_at_depth(st, k)
+        dtype = np.dtype(st.internal_nodes.store.typecode)
+        if alphabet is not None:
+            ranks = np.full(max(256, int(text.max(initial=0)) + 1), -1, dtype=np.int64)
+            ranks[alphabet] = np.arange(len(alphabet))
+            index = np.zeros(len(loci), dtype=np.int64)
+            in_alphabet = np.ones(len(loci), dtype=bool)
+            for j in range(k):
+                digit = ranks[text[occurrences + j]]
+                in_alphabet &= digit >= 0
+                index = index * len(alphabet) + digit
+            values = np.zeros(len(alphabet) ** k, dtype=dtype)
+            values[index[in_alphabet]] = loci[in_alphabet]
+            return cls(k, values, alphabet=alphabet)
+        keys = np.empty((len(loci), k), dtype=text.dtype)
+        for j in range(k):
+            keys[:, j] = text[occurrences + j]
+        return cls(k, loci.astype(dtype), keys=keys.ravel(), itemsize=text.itemsize)
+
+    @staticmethod
+    def _dense_alphabet(text, k):
+        """codes of a dense table: ACGT for DNA, every code of a small alphabet, None for a hashed table"""
+        counts = np.bincount(text, minlength=256)
+        present = np.flatnonzero(counts).tolist()
+        limit = min(DENSE_LIMIT, DENSE_PER_VALUE * len(text))
+        if counts[list(DNA)].sum() >= DNA_SHARE * len(text):
+            dna = [code for code in DNA if counts[code]]
+            return dna if len(dna) ** k <= limit else None
+        if present and present[-1] < 256 and len(present) <= len(DIGITS) and len(present) ** k <= limit:
+            return present
+        return None
+
+    def lookup(self, pattern):
+        """ChildIndex code of the location after the first k values of pattern (a code array),
+        ABSENT if they do not occur, None if the table cannot tell"""
+        window = pattern[:self.k]
+        if len(window) < self.k:
+            return None
+        if self.digits is not None:
+            if type(window) is not bytes:
+                window = _narrow(window)
+                if window is None:
+                    return None
+            try:
+                return self.slots[int(window.translate(self.digits), self.base)]
+            except ValueError:
+                return None
+        if self.index is None:
+            self._index()
+        if self.itemsize == 1:
+            if type(window) is not bytes:
+                window = _narrow(window)
+        else:
+            window = array('I', memoryview(window).tolist()).tobytes()
+        return self.index.get(window, ABSENT)
+
+    def _index(self):
+        rows = np.asarray(self.keys).view(np.uint8).reshape(len(self.values), self.k * self.itemsize)
+        self.index = dict(zip(rows.view(f'V{rows.shape[1]}').ravel().tolist(), np.asarray(self.values).tolist()))
+
+    def to_sections(self):
+        """header and sections to save the table with, see from_sections"""
+        header = {'k': self.k, 'itemsize': self.itemsize}
+        sections = {'kmers.values': np.asarray(self.values)}
+        if self.alphabet is not None:
+            header['alphabet'] = self.alphabet
+        else:
+            sections['kmers.keys'] = np.asarray(self.keys)
+        return {'kmers': header}, sections
+
+    @classmethod
+    def from_sections(cls, header, sections):
+        """the table saved by to_sections, None if there is none"""
+        if 'kmers' not in header:
+            return None
+        table = header['kmers']
+        return cls(table['k'], sections['kmers.values'], alphabet=table.get('alphabet'),
+                   keys=sections.get('kmers.keys'), itemsize=table['itemsize'])
+
+    def save(self, path):
+        """Write the table as its own section file, next to the pickles of a tree"""
+        header, sections = self.to_sections()
+        write_sections(path, header, sections)
+
+    @classmethod
+    def load(cls, path):
+        """Open a table written by save, mapped read-only"""
+        header, sections, mm = open_sections(path)
+        table = cls.from_sections(header, sections)
+        table.mapped = mm
+        return table
@@ -0,0 +1,76 @@
+"""Section file: a JSON header followed by fixed-width numpy columns, opened with mmap.
+
+Layout:
+    8 bytes   MAGIC
+    8 bytes   header length, little-endian
+    header    JSON, {"sections": {name: [offset, dtype, count]}, ...}, offsets relative to the payload
+    payload   starts at the first ALIGNMENT boundary after the header, each section aligned too
+
+Opening a file maps it read-only, every section is a zero-copy numpy view of the mapping,
+so loading is constant time and the pages are shared by every process mapping the same file.
+
+   >>> import os, tempfile
+   >>> path = os.path.join(tempfile.mkdtemp(), 'x.npst')
+   >>> write_sections(path, {'name': 'x'}, {'a': np.arange(5), 'b': np.frombuffer(b'xyz', dtype=np.uint8)})
+   >>> header, sections, mm = open_sections(path)
+   >>> header['name'], sections['a'].tolist(), bytes(sections['b'])
+   ('x', [0, 1, 2, 3, 4], b'xyz')
+"""
+import json
+import mmap
+import os
+
+import numpy as np
+
+MAGIC = b'NPST\x00\x00\x00\x01'
+ALIGNMENT = 64
+
+
+def _aligned(n):
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+def write_sections(path, header, sections, durable=False):
+    """Write header and named numpy arrays to path, through a temporary file and an atomic rename.
+    durable also syncs the file to disk before the rename"""
+    header = dict(header)
+    sections = dict(sections)
+    offsets = {}
+    offset = 0
+    for name, values in sections.items():
+        values = np.ascontiguousarray(values)
+        sections[name] = values
+        offsets[name] = [offset, values.dtype.str, len(values)]
+        offset = _aligned(offset + values.nbytes)
+    header['sections'] = offsets
+    header_bytes = json.dumps(header).encode()
+    payload_start = _aligned(len(MAGIC) + 8 + len(header_bytes))
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as out_file:
+        out_file.write(MAGIC)
+        out_file.write(len(header_bytes).to_bytes(8, 'little'))
+        out_file.write(header_bytes)
+        for name, values in sections.items():
+            out_file.seek(payload_start + offsets[name][0])
+            out_file.write(memoryview(values).cast('B'))
+        out_file.truncate(payload_start + offset)
+        if durable:
+            out_file.flush()
+            os.fsync(out_file.fileno())
+    os.replace(tmp_path, path)
+
+
+def open_sections(path):
+    """Map path read-only, returns (header, {name: numpy view}, mmap)"""
+    with open(path, 'rb') as in_file:
+        mm = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not an npst section file")
+    header_length = int.from_bytes(mm[len(MAGIC):len(MAGIC) + 8], 'little')
+    header_start = len(MAGIC) + 8
+    header = json.loads(mm[header_start:header_start + header_length])
+    payload_start = _aligned(header_start + header_length)
+    sections = {name: np.frombuffer(mm, dtype=np.dtype(dtype), count=count, offset=payload_start + offset)
+                for name, (offset, dtype, count) in header['sections'].items()}
+    return header, sections, mm
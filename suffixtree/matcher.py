@@ -0,0 +1,188 @@
+"""
+Streaming matcher: feeds a query one value at a time and keeps the longest match against the tree.
+
+With restart=SUFFIX_LINK a mismatch drops values from the front of the current match by following
+the suffix links stored in the sL column, then skip/counts back down, so the match is never thrown
+away and each value costs amortized O(1).  After value j, match_length is the length of the longest
+suffix of query[:j + 1] occurring in the tree, the matching statistics of the query.
+
+With restart=ROOT a mismatch throws the current match away and the mismatching value is skipped,
+the behaviour of the original visualize.py rules.
+
+   >>> from suffixtree.builder.tree_builder import TreeBuilder
+   >>> st = TreeBuilder("mississippi$").build_tree()
+   >>> [m.match_length for m in StreamMatcher(st).match("ssissippix")]
+   [1, 2, 3, 4, 5, 6, 7, 8, 9, 0]
+   >>> [m.match_length for m in StreamMatcher(st).match("missipp")]
+   [1, 2, 3, 4, 5, 5, 6]
+   >>> [m.match_length for m in StreamMatcher(st, restart=ROOT).match("missipp")]
+   [1, 2, 3, 4, 5, 0, 1]
+   >>> matcher = StreamMatcher(st)
+   >>> matcher.feed(ord('s')), matcher.feed(ord('s')), matcher.feed(ord('i'))
+   (1, 2, 3)
+   >>> st.get_suffixes(matcher.location()).tolist(), matcher.text_end()
+   ([5, 2], 5)
+   >>> st.kmer_k = 3
+   >>> st.finalize()
+   >>> matcher = StreamMatcher(st, restart=ROOT)
+   >>> matcher.jump(to_codes("ssip")), matcher.match_length, matcher.feed(ord('p'))
+   (True, 3, 4)
+   >>> matcher.reset()
+   >>> matcher.jump(to_codes("ssx")), matcher.jump(to_codes("ss")), matcher.match_length
+   (False, False, 0)
+"""
+from collections import namedtuple
+
+from data_source.codes import to_codes
+from suffixtree.location import Location
+
+Match = namedtuple('Match', 'query_offset match_length node')
+Match.__doc__ = """The longest match ending at query_offset: it spans query[query_offset + 1 - match_length:query_offset + 1],
+node is the ChildIndex code of the node at or below the end of the match (0 is the root, ~leaf for a leaf)"""
+
+SUFFIX_LINK = 'suffix_link'
+ROOT = 'root'
+RESTARTS = (SUFFIX_LINK, ROOT)
+
+
+class StreamMatcher:
+    """Longest match of a value stream against a finished SuffixTree.
+
+    The match is the path label of node plus the first k values of the edge down to child
+    (k is 0 when the match ends on node), it is match_length values long."""
+
+    def __init__(self, st, restart=SUFFIX_LINK):
+        if restart not in RESTARTS:
+            raise ValueError(f"restart must be one of {RESTARTS}, not {restart!r}")
+        self.st = st
+        self.restart = restart
+        internal_nodes = st.internal_nodes
+        self.iESO, self.iEEO, self.sL = internal_nodes.iESO, internal_nodes.iEEO, internal_nodes.sL
+        self.sD, self.leaf_parent = internal_nodes.sD, st.leaf_nodes.parent
+        self.parent = internal_nodes.parent
+        self.children, self.codes = st.children, st.codes
+        self.text_length = len(st.codes)
+        self.root = internal_nodes.root
+        # edges descended by _skip_count_down, read by suffixtree.profiler
+        self.hops = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the current match"""
+        self.node = self.root
+        self.child = None
+        self.k = 0
+        self.match_length = 0
+        # (text offset, length) of the incoming edge of child, while k > 0
+        self.edge_start = self.edge_length = 0
+
+    def _edge(self, child):
+        """(text offset, length) of the incoming edge of a ChildIndex code"""
+        if child > 0:
+            return self.iESO[child], self.iEEO[child] - self.iESO[child]
+        start = ~child + self.sD[self.leaf_parent[~child]]
+        return start, self.text_length - start
+
+    def _extend(self, value):
+        if not self.k:
+            child = self.children.get(self.node, value)
+            if child is None:
+                return False
+            self.child = child
+            self.edge_start, self.edge_length = self._edge(child)
+        elif self.k == self.edge_length or self.codes[self.edge_start + self.k] != value:
+            return False
+        self.k += 1
+        self.match_length += 1
+        if self.k == self.edge_length and self.child > 0:
+            self.node, self.child, self.k = self.child, None, 0
+        return True
+
+    def _skip_count_down(self, node, start, k):
+        """move to the end of codes[start:start + k] below node, which must be in the tree"""
+        while k:
+            child = self.children.get(node, self.codes[start])
+            self.hops += 1
+            edge_start, length = self._edge(child)
+            if child < 0 or k < length:
+                self.node, self.child, self.k = node, child, k
+                self.edge_start, self.edge_length = edge_start, length
+                return
+            node, start, k = child, start + length, k - length
+        self.node, self.child, self.k = node, None, 0
+
+    def jump(self, window):
+        """From an empty match, match the first k values of window with one lookup in the KmerTable of the tree,
+        the same match as feeding them one at a time.  False, with the match left empty, when there is no
+        table, it cannot tell, or the k-mer does not occur"""
+        kmers = self.st.kmers
+        if kmers is None or self.match_length:
+            return False
+        x = kmers.lookup(window)
+        if not x:
+            return False
+        k = kmers.k
+        if x > 0 and self.sD[x] == k:
+            self.node, self.child, self.k = x, None, 0
+        else:
+            parent = self.parent[x] if x > 0 else self.leaf_parent[~x]
+            self.node, self.child, self.k = parent, x, k - self.sD[parent]
+            self.edge_start, self.edge_length = self._edge(x)
+        self.match_length = k
+        return True
+
+    def shorten(self):
+        """Drop the first value of the current match (with restart=ROOT, drop the whole match)"""
+        if self.restart == ROOT or self.match_length <= 1:
+            self.reset()
+            return
+        start = self.edge_start if self.k else 0
+        if self.node == self.root:
+            self.match_length -= 1
+            self._skip_count_down(self.root, start + 1, self.k - 1)
+            return
+        link = self.sL[self.node]
+        self.match_length -= 1
+        if link < 0:
+            # no suffix link (a tree that is not finished), walk the shortened match down from the root
+            end = self.text_end()
+            self._skip_count_down(self.root, end - self.match_length, self.match_length)
+        else:
+            self._skip_count_down(link, start, self.k)
+
+    def feed(self, value):
+        """Extend the match by a code, returns the new match_length"""
+        while not self._extend(value):
+            if not self.match_length or self.restart == ROOT:
+                self.reset()
+                return 0
+            self.shorten()
+        return self.match_length
+
+    def match(self, query):
+        """Generator of a Match per value of query (str or code array)"""
+        for query_offset, value in enumerate(to_codes(query)):
+            self.feed(value)
+            yield Match(query_offset, self.match_length, self.locus)
+
+    @property
+    def locus(self):
+        """ChildIndex code of the node at or below the end of the match"""
+        return self.child if self.k else self.node
+
+    def text_end(self):
+        """text offset just past one occurrence of the match"""
+        if self.k:
+            return self.edge_start + self.k
+        return self.iEEO[self.node]
+
+    def location(self):
+        """the current match as a Location, for SuffixTree.get_suffixes and friends"""
+        location = Location()
+        if self.k and self.child > 0:
+            location.internal_edge(self.st.internal_nodes.edge(self.child), self.k)
+        elif self.k:
+            location.leaf_edge(self.st.leaf_nodes.edge(~self.child), self.k)
+        else:
+            location.internal_node(self.st.internal_nodes.edge(self.node))
+        return location
@@ -0,0 +1,135 @@
+"""
+Per-rule profiler for the rule engines: ValueProcessor (the builder rules, attach it with TreeBuilder.attach)
+and the visualize.py RuleRunner (its attach).  Both run the fast loop again once it is detached,
+so profiling is switched on and off at runtime by attaching and detaching.
+
+For every rule it counts the calls and their total time, and keeps up to max_samples call latencies
+(a uniform reservoir sample once there are more) for the percentiles.  Engines that count skip/count
+hops in a `hops` attribute (ValueProcessor, StreamMatcher) also get the hops of every rule and the
+distribution of hops per value.
+
+   >>> from suffixtree.builder.tree_builder import TreeBuilder
+   >>> tb = TreeBuilder("mississippi$")
+   >>> profiler = RuleProfiler()
+   >>> tb.attach(profiler)
+   >>> st = tb.build_tree()
+   >>> tb.detach(profiler)
+   >>> stats = profiler.to_dict()
+   >>> stats['values'], {rule: row['calls'] for rule, row in sorted(stats['rules'].items())}
+   (12, {'_add_leaf': 12, '_goto_suffix': 12, '_skip_count_down': 3, '_split_internal_edge': 1, '_split_leaf_edge': 5, '_traverse_value': 19})
+   >>> stats['rules']['_skip_count_down']['hops'], stats['hops_per_value']
+   (5, {'0': 11, '5': 1})
+   >>> print(profiler.summary().splitlines()[0])
+   rule                      calls   total ms  share   mean us    p50 us    p95 us    p99 us    max us      hops
+"""
+import json
+import random
+from array import array
+from collections import Counter
+from time import perf_counter_ns
+
+import numpy as np
+
+MAX_SAMPLES = 100_000
+PERCENTILES = (50, 95, 99)
+
+
+class RuleStats:
+    """calls, total nanoseconds, hops and a latency sample of one rule"""
+
+    def __init__(self, max_samples, rng):
+        self.calls = 0
+        self.total_ns = 0
+        self.hops = 0
+        self.samples = array('q')
+        self.max_samples = max_samples
+        self.rng = rng
+
+    def add(self, ns, hops):
+        self.calls += 1
+        self.total_ns += ns
+        self.hops += hops
+        if len(self.samples) < self.max_samples:
+            self.samples.append(ns)
+        else:
+            slot = self.rng.randrange(self.calls)
+            if slot < self.max_samples:
+                self.samples[slot] = ns
+
+    def to_dict(self):
+        samples = np.frombuffer(self.samples, dtype=np.int64) if self.samples else np.zeros(1, dtype=np.int64)
+        row = {'calls': self.calls, 'total_ns': self.total_ns, 'hops': self.hops,
+               'mean_ns': self.total_ns / self.calls if self.calls else 0.0, 'max_ns': int(samples.max())}
+        for percentile, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+            row[f'p{percentile}_ns'] = float(value)
+        return row
+
+
+class RuleProfiler:
+    """Rule engine observer collecting RuleStats per rule name and the hops per value"""
+
+    def __init__(self, max_samples=MAX_SAMPLES, seed=0):
+        self.max_samples = max_samples
+        self.rng = random.Random(seed)
+        self.reset()
+
+    def reset(self):
+        self.rules = {}
+        self.values = 0
+        self.hops_per_value = Counter()
+        self.value_hops = None
+        self.start_ns = None
+        self.start_hops = 0
+
+    def step_processing(self, offset, value):
+        if self.value_hops is not None:
+            self.hops_per_value[self.value_hops] += 1
+        self.values += 1
+        self.value_hops = 0
+
+    def before_rule(self, fn, context):
+        self.start_hops = getattr(context, 'hops', 0)
+        self.start_ns = perf_counter_ns()
+
+    def after_rule(self, fn, context):
+        ns = perf_counter_ns() - self.start_ns
+        hops = getattr(context, 'hops', 0) - self.start_hops
+        name = getattr(fn, '__name__', None) or fn.func.__name__
+        stats = self.rules.get(name)
+        if stats is None:
+            stats = self.rules[name] = RuleStats(self.max_samples, self.rng)
+        stats.add(ns, hops)
+        if self.value_hops is not None:
+            self.value_hops += hops
+
+    def to_dict(self):
+        """counts, latencies in nanoseconds, hops per rule and the number of values per hop count"""
+        hops_per_value = self.hops_per_value.copy()
+        if self.value_hops is not None:
+            hops_per_value[self.value_hops] += 1
+        return {'values': self.values,
+                'rules': {name: stats.to_dict() for name, stats in self.rules.items()},
+                'hops_per_value': {str(hops): n for hops, n in sorted(hops_per_value.items())}}
+
+    def dump(self, path):
+        with open(path, 'w') as out_file:
+            json.dump(self.to_dict(), out_file, indent=1)
+
+    def summary(self):
+        """a table of the rules, most total time first, and the hops per value"""
+        stats = self.to_dict()
+        total = sum(row['total_ns'] for row in stats['rules'].values()) or 1
+        lines = [f"{'rule':<22} {'calls':>8} {'total ms':>10} {'share':>6} {'mean us':>9} {'p50 us':>9} "
+                 f"{'p95 us':>9} {'p99 us':>9} {'max us':>9} {'hops':>9}"]
+        for name, row in sorted(stats['rules'].items(), key=lambda item: -item[1]['total_ns']):
+            lines.append(f"{name:<22} {row['calls']:8} {row['total_ns'] / 1e6:10.2f} {row['total_ns'] / total:6.1%} "
+                         f"{row['mean_ns'] / 1e3:9.2f} {row['p50_ns'] / 1e3:9.2f} {row['p95_ns'] / 1e3:9.2f} "
+                         f"{row['p99_ns'] / 1e3:9.2f} {row['max_ns'] / 1e3:9.2f} {row['hops']:9}")
+        hops = np.array([int(n) for n in stats['hops_per_value']], dtype=np.int64)
+        if len(hops):
+            values = np.array(list(stats['hops_per_value'].values()), dtype=np.int64)
+            cumulative = np.cumsum(values)
+            p95, p99 = (hops[np.searchsorted(cumulative, cumulative[-1] * p / 100)] for p in (95, 99))
+            lines.append(f"{stats['values']} values, skip/count hops per value: "
+                         f"mean {(hops * values).sum() / cumulative[-1]:.3f}, p95 {p95}, p99 {p99}, max {hops.max()}")
+        return '\n'.join(lines)
@@ -0,0 +1,122 @@
+"""
+Query worker processes sharing one tree.
+
+The tree is saved once in the mapped format (see SuffixTree.save_mapped), and every worker opens it
+with load_mapped: the node columns, positions and code array are read-only views of the same file,
+so the pages are shared between the workers through the page cache instead of copied per process.
+
+Batches of patterns are split into chunks that the workers search with find_many.
+A long query stream is split into chunks too, each chunk is matched from overlap values before its
+start, so the match length at every offset is exact as long as it is at most overlap + 1.
+That holds for restart=SUFFIX_LINK only: with restart=ROOT the state at a chunk start depends on
+where earlier matches were thrown away, so a ROOT query is matched as one chunk.
+
+   >>> import os, tempfile
+   >>> from suffixtree.builder.tree_builder import TreeBuilder
+   >>> st = TreeBuilder("mississippi$").build_tree()
+   >>> prefix = os.path.join(tempfile.mkdtemp(), 'miss')
+   >>> with QueryPool.from_tree(st, prefix, workers=2) as pool:
+   ...     matches = pool.find_many(["issi", "ss", "x", "mississippi"], chunk_size=2)
+   ...     match_length, node = pool.matching_statistics("missippississ", chunk_size=4, overlap=5)
+   >>> matches.count.tolist()
+   [2, 2, 0, 1]
+   >>> match_length.tolist()
+   [1, 2, 3, 4, 5, 5, 6, 7, 2, 3, 4, 5, 6]
+   >>> query = "ssisimpspisimipispiiipsspimism"
+   >>> with QueryPool(prefix, workers=2) as pool:
+   ...     stats = {restart: pool.matching_statistics(query, chunk_size=5, overlap=12, restart=restart)[0].tolist()
+   ...              for restart in RESTARTS}
+   >>> [stats[restart] == [match.match_length for match in StreamMatcher(st, restart).match(query)]
+   ...  for restart in RESTARTS]
+   [True, True]
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from data_source.codes import to_codes
+from suffixtree.matcher import StreamMatcher, SUFFIX_LINK, ROOT, RESTARTS
+from suffixtree.search import Matches
+from suffixtree.suffixtree import SuffixTree
+
+CHUNK_SIZE = 10_000
+STREAM_CHUNK_SIZE = 1 << 20
+OVERLAP = 1000
+
+# the tree of a worker process, opened once by _open_tree
+_tree = None
+
+
+def _open_tree(path_prefix):
+    global _tree
+    _tree = SuffixTree.load_mapped(path_prefix)
+
+
+def _find_many(patterns):
+    return _tree.find_many(patterns)
+
+
+def _matching_statistics(query, skip, restart):
+    """match lengths and nodes of query[skip:], after matching query[:skip] to warm up"""
+    matcher = StreamMatcher(_tree, restart)
+    match_length = np.zeros(len(query) - skip, dtype=np.int64)
+    node = np.zeros(len(query) - skip, dtype=np.int64)
+    for offset, value in enumerate(query):
+        matcher.feed(value)
+        if offset >= skip:
+            match_length[offset - skip] = matcher.match_length
+            node[offset - skip] = matcher.locus
+    return match_length, node
+
+
+class QueryPool:
+    """worker processes (default: one per core) that each map the tree saved at path_prefix.npst"""
+
+    def __init__(self, path_prefix, workers=None):
+        if not os.path.exists(f'{path_prefix}.npst'):
+            raise FileNotFoundError(f"{path_prefix}.npst not found, save the tree with SuffixTree.save_mapped")
+        self.path_prefix = path_prefix
+        self.workers = workers or os.cpu_count()
+        self.executor = ProcessPoolExecutor(self.workers, initializer=_open_tree, initargs=(path_prefix,))
+
+    @classmethod
+    def from_tree(cls, st, path_prefix, workers=None):
+        """Save a tree in the mapped format, then start workers on it"""
+        st.save_mapped(path_prefix)
+        return cls(path_prefix, workers)
+
+    def find_many(self, patterns, chunk_size=CHUNK_SIZE):
+        """SuffixTree.find_many spread over the workers, Matches in input order"""
+        patterns = list(patterns)
+        chunks = [patterns[start:start + chunk_size] for start in range(0, len(patterns), chunk_size)]
+        results = list(self.executor.map(_find_many, chunks))
+        if not results:
+            return Matches(*(np.zeros(0, dtype=dtype) for dtype in (bool, np.int64, np.int64, np.int64)))
+        return Matches(*(np.concatenate(columns) for columns in zip(*results)))
+
+    def matching_statistics(self, query, chunk_size=STREAM_CHUNK_SIZE, overlap=OVERLAP, restart=SUFFIX_LINK):
+        """(match_length, node) numpy arrays with the StreamMatcher state after every value of query,
+        see suffixtree.matcher, computed chunk by chunk in the workers (in one chunk with restart=ROOT)"""
+        codes = to_codes(query)
+        if restart == ROOT:
+            chunk_size = max(len(codes), 1)
+        jobs = []
+        for start in range(0, len(codes), chunk_size):
+            warm_up = min(start, overlap)
+            jobs.append(self.executor.submit(_matching_statistics, codes[start - warm_up:start + chunk_size],
+                                             warm_up, restart))
+        results = [job.result() for job in jobs]
+        if not results:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        match_length, node = zip(*results)
+        return np.concatenate(match_length), np.concatenate(node)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,103 @@
+"""
+Repeats of a finished SuffixTree, from one pass over its internal nodes.
+
+Every internal node is a right-maximal repeat, its string depth (sD) is the repeat length and its
+leaves, positions[first_leaf:last_leaf], are the occurrences.  The left character of an occurrence
+is the code before it in the data source (none for the occurrence at offset 0).
+    maximal repeat:       an internal node whose occurrences do not all have the same left character
+    supermaximal repeat:  an internal node whose children are all leaves, with pairwise distinct left characters,
+                          a maximal repeat that is no substring of another maximal repeat
+    longest repeated substring: the deepest internal nodes
+
+The leaves below a node are consecutive in the DFS numbering, so left diversity of every node
+comes from one prefix sum over the left characters in leaf order: linear in the tree size.
+
+   >>> from suffixtree.builder.tree_builder import TreeBuilder
+   >>> st = TreeBuilder("mississippi$").build_tree()
+   >>> [(repeat_string(st, repeat), repeat.positions.tolist()) for repeat in maximal_repeats(st)]
+   [('issi', [4, 1]), ('i', [10, 7, 4, 1]), ('p', [9, 8]), ('s', [6, 3, 5, 2])]
+   >>> [repeat_string(st, repeat) for repeat in supermaximal_repeats(st)]
+   ['issi', 'p']
+   >>> [repeat_string(st, repeat) for repeat in maximal_repeats(st, min_length=2)]
+   ['issi']
+   >>> [(repeat_string(st, repeat), repeat.length) for repeat in longest_repeated_substrings(st)]
+   [('issi', 4)]
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from data_source.codes import code_view
+
+Repeat = namedtuple('Repeat', 'node length positions')
+Repeat.__doc__ = """A repeat at internal node, length values long, occurring at positions (in DFS order)"""
+
+NO_LEFT = -1
+
+
+def _columns(st):
+    """string depth, first leaf, last leaf of every internal node but the root, as numpy arrays"""
+    if not st.finalized:
+        st.finalize()
+    internal_nodes = st.internal_nodes
+    n = len(internal_nodes)
+    depth = internal_nodes.store.view('sD', n).astype(np.int64)
+    first_leaf = np.asarray(internal_nodes.first_leaf[:n], dtype=np.int64)
+    last_leaf = np.asarray(internal_nodes.last_leaf[:n], dtype=np.int64)
+    return depth, first_leaf, last_leaf
+
+
+def left_codes(st):
+    """left character code of every leaf in DFS order, NO_LEFT for the suffix at offset 0"""
+    positions = np.asarray(st.positions, dtype=np.int64)
+    codes = code_view(st.codes)
+    left = codes[np.maximum(positions - 1, 0)].astype(np.int64)
+    left[positions == 0] = NO_LEFT
+    return left
+
+
+def _repeats(st, nodes, depth, first_leaf, last_leaf):
+    """Repeats of nodes, longest first"""
+    order = np.lexsort((first_leaf[nodes], -depth[nodes]))
+    return [Repeat(node, int(depth[node]), st.positions[first_leaf[node]:last_leaf[node]])
+            for node in nodes[order].tolist()]
+
+
+def maximal_repeats(st, min_length=1):
+    """Repeats at least min_length long that are left-diverse, longest first"""
+    depth, first_leaf, last_leaf = _columns(st)
+    left = left_codes(st)
+    # changes[k] counts the left character changes between leaves 0 and k in DFS order
+    changes = np.concatenate(([0], np.cumsum(left[1:] != left[:-1])))
+    diverse = changes[last_leaf - 1] > changes[first_leaf]
+    nodes = np.flatnonzero(diverse & (depth >= max(min_length, 1)))
+    return _repeats(st, nodes, depth, first_leaf, last_leaf)
+
+
+def supermaximal_repeats(st, min_length=1):
+    """Repeats at least min_length long that are no substring of another maximal repeat, longest first"""
+    depth, first_leaf, last_leaf = _columns(st)
+    left = left_codes(st)
+    internal_nodes = st.internal_nodes
+    n = len(internal_nodes)
+    internal_children = np.bincount(internal_nodes.store.view('parent', n)[1:].astype(np.int64), minlength=n)
+    candidates = np.flatnonzero((internal_children == 0) & (depth >= max(min_length, 1)))
+    # every leaf has one parent, so the candidates' intervals are disjoint and this is linear
+    nodes = np.array([node for node in candidates.tolist()
+                      if len(set(left[first_leaf[node]:last_leaf[node]].tolist())) == last_leaf[node] - first_leaf[node]],
+                     dtype=np.int64)
+    return _repeats(st, nodes, depth, first_leaf, last_leaf)
+
+
+def longest_repeated_substrings(st, min_length=1):
+    """The Repeats of the greatest length, none if that is less than min_length"""
+    depth, first_leaf, last_leaf = _columns(st)
+    longest = int(depth.max())
+    if longest < max(min_length, 1):
+        return []
+    return _repeats(st, np.flatnonzero(depth == longest), depth, first_leaf, last_leaf)
+
+
+def repeat_string(st, repeat):
+    start = int(repeat.positions[0])
+    return st.data_source[start:start + repeat.length]
@@ -0,0 +1,209 @@
+"""
+Pattern search against a finished SuffixTree, single patterns and batches.
+
+Patterns are sorted, and each one resumes from the deepest node on the path of the previous
+pattern that is within their common prefix, so shared prefixes are walked once.
+Edges are compared a whole slice at a time against the code array.  A tree with a KmerTable
+(suffixtree.kmer_table) starts every walk shallower than k at depth k, with one table lookup.
+
+   >>> from suffixtree.builder.tree_builder import TreeBuilder
+   >>> st = TreeBuilder("mississippi$").build_tree()
+   >>> matches = st.find_many(["issi", "ss", "x", "mississippi", "", "ppi$q"])
+   >>> matches.found.tolist()
+   [True, True, False, True, True, False]
+   >>> matches.count.tolist()
+   [2, 2, 0, 1, 12, 0]
+   >>> matches.position.tolist()
+   [4, 5, -1, 0, 11, -1]
+   >>> [matches.count.tolist() for patterns, matches in st.iter_find_many(iter(["s\\n", "si\\n", "p\\n"]), batch_size=2)]
+   [[4, 2], [2]]
+   >>> st.count("ssi"), st.count("i"), st.count("pi$"), st.count("spi")
+   (2, 4, 1, 0)
+   >>> st.find_all("ssi").tolist(), st.find_all("pi$").tolist(), st.find_all("spi").tolist()
+   ([5, 2], [9], [])
+   >>> st = TreeBuilder("καλη μερα, good day$").build_tree()
+   >>> st.count("good"), st.count(" "), st.count("μερα"), st.find_many(["good", "day", "ερα", "x"]).found.tolist()
+   (1, 3, 1, [True, True, True, False])
+   >>> st = TreeBuilder("mississippi$").build_tree()
+   >>> st.find_many(["ss", "sΔ", "si"]).found.tolist()
+   [True, False, True]
+   >>> st.kmer_k = 2
+   >>> st.finalize()
+   >>> st.find_many(["issi", "ss", "x", "mississippi", "", "ppi$q"]).count.tolist()
+   [2, 2, 0, 1, 12, 0]
+   >>> st.count("ssi"), st.count("i"), st.count("pi$"), st.count("spi"), st.count("sm")
+   (2, 4, 1, 0, 0)
+"""
+from array import array
+from collections import namedtuple
+from itertools import islice
+
+import numpy as np
+
+from data_source.codes import to_codes
+
+Matches = namedtuple('Matches', 'found count node position')
+Matches.__doc__ = """Per pattern, in input order: found (bool), count of occurrences,
+node (the ChildIndex code of the node at or below the match, 0 is the root, ~leaf for a leaf)
+and position (the offset of one occurrence, -1 if not found)"""
+
+BATCH_SIZE = 100_000
+
+
+def pattern_codes(pattern, wide=False):
+    """code array for a pattern, lines read from a file lose their line ending.
+    wide makes it array('I') even when every code fits in a byte, to compare with the codes of a wide tree"""
+    if isinstance(pattern, str):
+        pattern = pattern.rstrip('\r\n')
+    codes = to_codes(pattern)
+    if wide and memoryview(codes).itemsize == 1:
+        codes = array('I', memoryview(codes).tolist())
+    return codes
+
+
+def _common_prefix_length(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class Walker:
+    """Walks code arrays down a finished tree, comparing whole edge slices at a time"""
+
+    def __init__(self, st):
+        if not st.finalized:
+            st.finalize()
+        self.st = st
+        internal_nodes = st.internal_nodes
+        self.iESO, self.iEEO, self.sD = internal_nodes.iESO, internal_nodes.iEEO, internal_nodes.sD
+        self.parent = internal_nodes.parent
+        self.leaf_parent = st.leaf_nodes.parent
+        self.children, self.codes = st.children, st.codes
+        self.text_length = len(st.codes)
+        # patterns are compared as array('I') codes against a wide tree, see pattern_codes
+        self.wide = memoryview(st.codes).itemsize > 1
+        self.nL = internal_nodes.nL
+        self.root = internal_nodes.root
+        self.kmers = st.kmers
+
+    def walk(self, node, pattern, i=0, path=None):
+        """Match pattern[i:] from internal node, returns the ChildIndex code of the node at or below
+        the end of the match (node itself if the match ends on it), None if pattern does not occur.
+        (pattern offset, node) of every internal node reached is appended to path"""
+        iESO, iEEO, sD, leaf_parent = self.iESO, self.iEEO, self.sD, self.leaf_parent
+        children, codes = self.children, self.codes
+        end = len(pattern)
+        while i < end:
+            child = children.get(node, pattern[i])
+            if child is None:
+                return None
+            if child > 0:
+                start, length = iESO[child], iEEO[child] - iESO[child]
+            else:
+                start = ~child + sD[leaf_parent[~child]]
+                length = self.text_length - start
+            m = min(length, end - i)
+            if codes[start:start + m] != pattern[i:i + m]:
+                return None
+            i += m
+            if m < length:
+                return child
+            if child < 0:
+                return None if i < end else child
+            node = child
+            if path is not None:
+                path.append((i, node))
+        return node
+
+    def locate(self, pattern, node=None, i=0, path=None):
+        """walk, from the root by default: a walk from above depth k starts at depth k with one lookup
+        in the KmerTable of the tree, if it has one"""
+        node = self.root if node is None else node
+        kmers = self.kmers
+        if kmers is not None and i < kmers.k:
+            x = kmers.lookup(pattern)
+            if x is not None:
+                return self.resume(x, pattern, kmers.k, path) if x else None
+        return self.walk(node, pattern, i, path)
+
+    def resume(self, x, pattern, i, path=None):
+        """walk on from pattern offset i, on the incoming edge of ChildIndex code x (at its end if
+        pattern[:i] spells out the path label of x)"""
+        if x > 0:
+            length = self.sD[x] - i
+            start = self.iEEO[x] - length
+        else:
+            start = ~x + i
+            length = self.text_length - start
+        end = len(pattern)
+        m = min(length, end - i)
+        if self.codes[start:start + m] != pattern[i:i + m]:
+            return None
+        i += m
+        if m < length:
+            return x
+        if x < 0:
+            return None if i < end else x
+        if path is not None:
+            path.append((i, x))
+        return self.walk(x, pattern, i, path)
+
+    def count(self, x):
+        """occurrences below a ChildIndex code"""
+        return 1 if x < 0 else self.nL[x]
+
+    def position(self, x):
+        """offset of one occurrence below a ChildIndex code"""
+        return ~x if x < 0 else self.st.positions[self.st.internal_nodes.first_leaf[x]]
+
+
+def locate(st, pattern):
+    """ChildIndex code of the node at or below the end of pattern, None if it does not occur"""
+    walker = Walker(st)
+    return walker.locate(pattern_codes(pattern, walker.wide))
+
+
+def find_many(st, patterns):
+    """Search every pattern (str, or code array) of an iterable, returns Matches of numpy arrays"""
+    walker = Walker(st)
+    patterns = [pattern_codes(pattern, walker.wide) for pattern in patterns]
+    n = len(patterns)
+    found = np.zeros(n, dtype=bool)
+    count = np.zeros(n, dtype=np.int64)
+    locus = np.zeros(n, dtype=np.int64)
+    position = np.full(n, -1, dtype=np.int64)
+
+    # (pattern offset, internal node) for every node reached by the previous pattern
+    path = [(0, st.internal_nodes.root)]
+    previous = None
+    # patterns with codes wider than a narrow tree's do not occur, and do not sort with bytes
+    searched = range(n) if walker.wide else [k for k in range(n) if not isinstance(patterns[k], array)]
+    for k in sorted(searched, key=patterns.__getitem__):
+        pattern = patterns[k]
+        if previous is not None:
+            shared = _common_prefix_length(previous, pattern)
+            while path[-1][0] > shared:
+                path.pop()
+        previous = pattern
+        i, node = path[-1]
+        x = walker.locate(pattern, node, i, path)
+        if x is None:
+            continue
+        found[k] = True
+        locus[k] = x
+        count[k] = walker.count(x)
+        position[k] = walker.position(x)
+    return Matches(found, count, locus, position)
+
+
+def iter_find_many(st, patterns, batch_size=BATCH_SIZE):
+    """Stream patterns (any iterable, an open file of one pattern per line works) through find_many
+    in batches, yields (batch of patterns, Matches) for each batch"""
+    patterns = iter(patterns)
+    while True:
+        batch = list(islice(patterns, batch_size))
+        if not batch:
+            return
+        yield batch, find_many(st, batch)
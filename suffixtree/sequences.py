@@ -0,0 +1,106 @@
+"""
+Generalized suffix tree support: many sequences concatenated into one text, each one followed by
+its own separator, a code that occurs nowhere else, so every suffix of every sequence is a leaf.
+
+SequenceMap records where each sequence starts, so a leaf (a suffix offset in the concatenated text)
+maps to (sequence_id, offset in the sequence) with a binary search over the starts.
+Suffixes that start on a separator belong to no sequence and are dropped from hits.
+
+   >>> from suffixtree.builder.tree_builder import TreeBuilder
+   >>> from suffixtree.matcher import StreamMatcher
+   >>> st = TreeBuilder.from_sequences(["ACGTA", "GTAC", "TTAC"], names=["chr1", "chr2", "chrM"]).build_tree()
+   >>> st.sequences.names, st.sequences.starts.tolist()
+   (['chr1', 'chr2', 'chrM'], [0, 6, 11])
+   >>> matcher = StreamMatcher(st)
+   >>> [matcher.feed(value) for value in b'TA']
+   [1, 2]
+   >>> st.get_suffixes(matcher.location())
+   [('chr2', 1), ('chrM', 1), ('chr1', 3)]
+   >>> st.sequences.locate(st.find_all("AC")).tolist()
+   [[0, 0], [1, 2], [2, 2]]
+
+A tree over many sequences of any text saves and loads with its sidecar files:
+
+   >>> import os, tempfile
+   >>> from suffixtree.suffixtree import SuffixTree
+   >>> from data_source.codes import write_data_file
+   >>> prefix = os.path.join(tempfile.mkdtemp(), 'many')
+   >>> st = TreeBuilder.from_sequences([f"seq {i}: text" for i in range(15)]).build_tree()
+   >>> st.internal_nodes.to_pickle(f'{prefix}_internal'), st.leaf_nodes.to_pickle(f'{prefix}_leaf')
+   (None, None)
+   >>> write_data_file(f'{prefix}.data', st.data_source), st.sequences.save(f'{prefix}_sequences.json')
+   (None, None)
+   >>> loaded = SuffixTree.load_from_path(prefix)
+   >>> loaded.data_source == st.data_source, loaded.find_many(["seq 14: text"]).count.tolist()
+   (True, [1])
+   >>> loaded.sequences.locate(loaded.find_all("14: ")).tolist()
+   [[14, 4]]
+"""
+import json
+from itertools import chain, islice
+
+import numpy as np
+
+# separators are taken from the upper half of latin-1 while they last, so DNA keeps its one byte codes,
+# and from the unicode private use planes after that.  Not the control codes below 32: line endings
+# and tabs are text, and a text sidecar could not keep them apart from separators
+SEPARATOR_RANGES = (range(0x80, 0x100), range(0xF0000, 0xFFFFE), range(0x100000, 0x10FFFE))
+
+
+def separators(n, used):
+    """n separator characters that are not in used"""
+    free = (chr(code) for code in chain(*SEPARATOR_RANGES) if chr(code) not in used)
+    result = list(islice(free, n))
+    if len(result) < n:
+        raise ValueError(f"{n} sequences need {n} separators, only {len(result)} codes are free")
+    return result
+
+
+class SequenceMap:
+    """names, start offsets and lengths of the sequences of a generalized tree"""
+
+    def __init__(self, names, starts, lengths):
+        self.names = list(names)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+
+    @classmethod
+    def concatenate(cls, sequences, names=None):
+        """(text, SequenceMap) for an iterable of sequences (str or Bio Seq), names default to '0', '1', ..."""
+        sequences = [str(sequence) for sequence in sequences]
+        names = [str(i) for i in range(len(sequences))] if names is None else list(names)
+        if len(names) != len(sequences):
+            raise ValueError(f"{len(names)} names for {len(sequences)} sequences")
+        used = set().union(*map(set, sequences))
+        lengths = [len(sequence) for sequence in sequences]
+        starts = np.cumsum([0] + [length + 1 for length in lengths[:-1]])
+        text = ''.join(chain.from_iterable(zip(sequences, separators(len(sequences), used))))
+        return text, cls(names, starts, lengths)
+
+    def locate(self, positions):
+        """(sequence_id, offset) rows for text offsets, a numpy array of shape (n, 2)"""
+        positions = np.asarray(positions, dtype=np.int64)
+        sequence_ids = np.searchsorted(self.starts, positions, side='right') - 1
+        return np.stack((sequence_ids, positions - self.starts[sequence_ids]), axis=1)
+
+    def hits(self, positions):
+        """(name, offset) for every text offset that is not on a separator"""
+        located = self.locate(positions)
+        on_sequence = located[:, 1] < self.lengths[located[:, 0]]
+        return [(self.names[sequence_id], offset) for sequence_id, offset in located[on_sequence].tolist()]
+
+    def to_header(self):
+        return {'names': self.names, 'starts': self.starts.tolist(), 'lengths': self.lengths.tolist()}
+
+    @classmethod
+    def from_header(cls, header):
+        return cls(header['names'], header['starts'], header['lengths'])
+
+    def save(self, path):
+        with open(path, 'w') as out_file:
+            json.dump(self.to_header(), out_file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as in_file:
+            return cls.from_header(json.load(in_file))
@@ -0,0 +1,99 @@
+"""
+Build one suffix tree per slice of a FASTA file in parallel, and query all of them as one.
+
+A slice is a record name with an optional 'min:max' slice spec (see data_source.fasta.parse_slice),
+written 'chr1', 'chr1:2:5', or just '2:5' for the first record.  Each slice is built in its own worker
+process, which writes its tree to disk in the mapped format.  The manifest (manifest.json in the
+output directory) lists every slice with the record, the global start offset and the tree prefix,
+relative to the manifest.
+
+SliceTrees fans a pattern out to every tree and reports the hits as (record, offset in the record).
+Slices that overlap report a hit in the overlap once.
+
+   >>> import os, tempfile
+   >>> out_dir = tempfile.mkdtemp()
+   >>> path = os.path.join(out_dir, 'test.fa')
+   >>> with open(path, 'w') as out_file:
+   ...     _ = out_file.write(">chr1\\nACGTACGTAC\\nGTTTACG\\n>chr2\\nTTACGA\\n")
+   >>> manifest = build_slices(path, ['chr1', 'chr2'], out_dir, max_workers=2)
+   >>> [(entry['record'], entry['start'], entry['length']) for entry in manifest['slices']]
+   [('chr1', 0, 17), ('chr2', 0, 6)]
+   >>> trees = SliceTrees(os.path.join(out_dir, MANIFEST))
+   >>> trees.find("ACG")
+   [('chr1', 0), ('chr1', 4), ('chr1', 8), ('chr1', 14), ('chr2', 2)]
+   >>> trees.count("TTA")
+   2
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from data_source.fasta import IndexedFasta, parse_slice
+from suffixtree.builder.tree_builder import TreeBuilder
+from suffixtree.suffixtree import SuffixTree
+
+MANIFEST = 'manifest.json'
+TERMINATOR = '$'
+
+
+def parse_slice_name(name, fasta):
+    """(record, start, end) for 'record', 'record:min:max' or 'min:max' (the first record)"""
+    fields = name.split(':')
+    if len(fields) == 2:
+        record, slice_spec = fasta.names[0], name
+    else:
+        record, slice_spec = fields[0], ':'.join(fields[1:])
+    start, end = parse_slice(slice_spec)
+    length = fasta.entry(record).length
+    return record, start, length if end is None else min(end, length)
+
+
+def build_slice(fasta_path, record, start, end, out_dir):
+    """Build the tree of one slice and save it in out_dir, returns its manifest entry.
+    Runs in a worker process."""
+    text = IndexedFasta(fasta_path).sequence(record, start, end)
+    st = TreeBuilder(text + TERMINATOR).build_tree()
+    tree = f'{record}_{start}_{end}'
+    st.save_mapped(os.path.join(out_dir, tree))
+    return {'record': record, 'start': start, 'length': len(text), 'tree': tree}
+
+
+def build_slices(fasta_path, slice_names, out_dir, max_workers=None):
+    """Build every slice in a process pool (max_workers defaults to the number of cores),
+    write and return the manifest"""
+    os.makedirs(out_dir, exist_ok=True)
+    fasta = IndexedFasta(fasta_path)
+    jobs = [parse_slice_name(name, fasta) for name in slice_names]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(build_slice, fasta_path, record, start, end, out_dir)
+                   for record, start, end in jobs]
+        entries = [future.result() for future in futures]
+    manifest = {'fasta': os.path.abspath(fasta_path), 'slices': entries}
+    with open(os.path.join(out_dir, MANIFEST), 'w') as out_file:
+        json.dump(manifest, out_file, indent=2)
+    return manifest
+
+
+class SliceTrees:
+    """The trees of a manifest, queried together in the coordinates of the FASTA records"""
+
+    def __init__(self, manifest_path):
+        with open(manifest_path) as in_file:
+            self.manifest = json.load(in_file)
+        manifest_dir = os.path.dirname(manifest_path)
+        self.slices = self.manifest['slices']
+        self.trees = [SuffixTree.load_from_path(os.path.join(manifest_dir, entry['tree'])) for entry in self.slices]
+
+    def find(self, pattern):
+        """Sorted (record, offset) of every occurrence of pattern in any slice"""
+        hits = set()
+        for entry, st in zip(self.slices, self.trees):
+            start = entry['start']
+            for position in st.find_all(pattern).tolist():
+                # the terminator matches only in a tree, not in the record
+                if position + len(pattern) <= entry['length']:
+                    hits.add((entry['record'], start + position))
+        return sorted(hits)
+
+    def count(self, pattern):
+        return len(self.find(pattern))
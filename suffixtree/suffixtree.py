@@ -1,59 +1,67 @@
-from suffixtree.tree_nodes import LeafNodes, InternalNodes
-import pandas as pd
+import os
+from array import array
 
-from suffixtree.location import Location
-
-# TODO: this needs to replace Location or be merged into it
-class Edge:
-    """API for leaf or internal edge
-
-    If leaf edge, data_row is:     ['parent', 'iESO', 'iESV'], index is suffix
-    If internal edge, data_row is: ['parent', 'iESO', 'iESV', 'iEEO', 'sL'], index is node_id, root is 0"""
-
-    def __init__(self, data_row):
-        self.data_row = data_row
-        self.is_internal = len(data_row) > 3
-        self.is_leaf = not self.is_internal
-
-    def suffix_offset(self):
-        return self.data_row.name
-
-    @property
-    def id(self):
-        return self.data_row.name
-
-    @property
-    def parent(self):
-        return self.data_row.parent
-
-    @property
-    def iESO(self):
-        return int(self.data_row.iESO)
-
-    @property
-    def iESV(self):
-        return self.data_row.iESV
-
-    @property
-    def iEEO(self):
-        return int(self.data_row.iEEO)
-
-    def parent(self):
-        return self.data_row.parent
+import numpy as np
 
-    def __len__(self):
-        try:
-            return int(self.data_row.iEEO - self.data_row.iESO)
-        except AttributeError:
-            return 0
+from suffixtree.tree_nodes import LeafNodes, InternalNodes, Edge, edge_columns, ArrayColumns, typecode_for
+from suffixtree.child_index import ChildIndex
+from suffixtree.kmer_table import KmerTable
+from suffixtree.mapped_file import write_sections, open_sections
+from suffixtree.sequences import SequenceMap
+from suffixtree.location import Location
+from suffixtree import search
+from data_source.codes import to_codes, code_encoding, code_view, read_data_file
 
 
 class SuffixTree:
     """SuffixTree data structure, either built from a data source, or loaded from a persistent copy"""
-    def __init__(self, internal_nodes, leaf_nodes, data_source):
+    FORMAT_VERSION = 4
+
+    def __init__(self, internal_nodes, leaf_nodes, data_source, children=None, codes=None):
+        """codes is the integer code array of data_source, see data_source.codes"""
         self.internal_nodes = internal_nodes
         self.leaf_nodes = leaf_nodes
         self.data_source = data_source
+        self.codes = to_codes(data_source) if codes is None else codes
+        leaf_nodes.attach(internal_nodes, self.codes)
+        if children is None:
+            children = ChildIndex.for_values(set(self.codes), internal_nodes.store.typecode)
+            children.rebuild(internal_nodes, leaf_nodes)
+        self.children = children
+        internal_nodes.children = self.children
+        leaf_nodes.children = self.children
+        # leaf ids in DFS order, filled in by finalize
+        self.positions = None
+        # SequenceMap of a generalized tree over many sequences, see suffixtree.sequences
+        self.sequences = None
+        # KmerTable built by finalize when kmer_k is set, or loaded with the tree, see suffixtree.kmer_table
+        self.kmer_k = None
+        self.kmers = None
+
+    def append_data(self, data):
+        """Append text (str or Bio Seq) to the data source and the code array, for a build that continues.
+
+        The code array becomes growable (bytearray or array('I')), the child index is rebuilt
+        if the new text brings values it has no slots for."""
+        text = str(data)
+        new_codes = to_codes(text)
+        n = len(self.codes) + len(new_codes)
+        typecode = self.internal_nodes.store.typecode
+        if typecode_for(n) != typecode:
+            raise ValueError(f"{n} values do not fit the '{typecode}' node columns of this tree")
+        wide = max(memoryview(new_codes).itemsize, memoryview(self.codes).itemsize) > 1
+        if wide and not isinstance(self.codes, array):
+            self.codes = array('I', memoryview(self.codes).tolist())
+        elif not wide and not isinstance(self.codes, bytearray):
+            self.codes = bytearray(self.codes)
+        self.codes.extend(new_codes)
+        self.leaf_nodes.codes = self.codes
+        self.data_source = str(self.data_source) + text
+        self.internal_nodes.data_source = self.leaf_nodes.data_source = self.data_source
+        if not self.children.covers(set(new_codes)):
+            self.children = ChildIndex.for_values(set(self.codes), typecode)
+            self.children.rebuild(self.internal_nodes, self.leaf_nodes)
+            self.internal_nodes.children = self.leaf_nodes.children = self.children
 
     def info(self):
         return f'{len(self.leaf_nodes)} leaf nodes, {len(self.internal_nodes)} internal nodes'
@@ -62,24 +70,220 @@ class SuffixTree:
     def load_from_path(cls, path_prefix):
         """Load a previously built suffix tree, uses path_prefix to get
         internal node DataFrame, leaf node DataFrame,
-        and the raw data used to build the suffix tree"""
-        data_source_path = f'{path_prefix}.data'
-        with open(data_source_path) as in_file:
-            data_source = in_file.read()
+        and the raw data used to build the suffix tree.
+
+        If a mapped copy (path_prefix.npst) exists, that is opened instead, see load_mapped.
+        A generalized tree also has its SequenceMap in path_prefix_sequences.json,
+        a k-mer jump table is in path_prefix_kmers.npst"""
+        if os.path.exists(f'{path_prefix}.npst'):
+            return cls.load_mapped(path_prefix)
+        data_source = read_data_file(f'{path_prefix}.data')
+
+        st = cls(InternalNodes.load_from_path(path_prefix, data_source),
+                 LeafNodes.load_from_path(path_prefix, data_source), data_source)
+        if os.path.exists(f'{path_prefix}_sequences.json'):
+            st.sequences = SequenceMap.load(f'{path_prefix}_sequences.json')
+        st.finalize()
+        if os.path.exists(f'{path_prefix}_kmers.npst'):
+            st.kmers = KmerTable.load(f'{path_prefix}_kmers.npst')
+            st.kmer_k = st.kmers.k
+        return st
+
+    def node_sections(self):
+        """{'internal.<column>': view, 'leaf.<column>': view} of the used rows of the node tables"""
+        sections = {}
+        for prefix, nodes in (('internal', self.internal_nodes), ('leaf', self.leaf_nodes)):
+            for name in nodes.COLUMNS:
+                sections[f'{prefix}.{name}'] = nodes.store.view(name, len(nodes))
+        return sections
+
+    def save_mapped(self, path_prefix):
+        """Write the tree as path_prefix.npst, a header plus fixed-width columns that load_mapped can mmap"""
+        if not self.finalized:
+            self.finalize()
+        internal_nodes, leaf_nodes = self.internal_nodes, self.leaf_nodes
+        header = {'version': self.FORMAT_VERSION, 'n_internal': len(internal_nodes), 'n_leaf': len(leaf_nodes),
+                  'typecode': internal_nodes.store.typecode, 'encoding': code_encoding(self.codes)}
+        if self.sequences is not None:
+            header['sequences'] = self.sequences.to_header()
+        sections = self.node_sections()
+        # the code array itself, so a mapped tree compares codes straight from the mapping
+        sections['data'] = code_view(self.codes)
+        sections['positions'] = self.positions
+        sections['first_leaf'] = np.asarray(internal_nodes.first_leaf)
+        sections['last_leaf'] = np.asarray(internal_nodes.last_leaf)
+        sections['leaf_count'] = np.asarray(internal_nodes.nL)
+        index_header, index_sections = self.children.to_sections()
+        header.update(index_header)
+        sections.update(index_sections)
+        if self.kmers is not None:
+            kmers_header, kmers_sections = self.kmers.to_sections()
+            header.update(kmers_header)
+            sections.update(kmers_sections)
+        write_sections(f'{path_prefix}.npst', header, sections)
+
+    @classmethod
+    def load_mapped(cls, path_prefix):
+        """Open path_prefix.npst read-only with mmap, the node columns are views of the mapping.
+
+        The node tables and the code array are paged in on demand and shared between
+        processes that map the same file, only the text is decoded into a str."""
+        header, sections, mm = open_sections(f'{path_prefix}.npst')
+        if header['version'] != cls.FORMAT_VERSION:
+            raise ValueError(f"{path_prefix}.npst has format version {header['version']}, expected {cls.FORMAT_VERSION}")
+        data = sections['data']
+        data_source = data.tobytes().decode(header['encoding'])
+        codes = memoryview(data) if header['encoding'] in ('latin-1', 'utf-32-le') else None
+
+        def columns(prefix, names):
+            return ArrayColumns({name: memoryview(sections[f'{prefix}.{name}']) for name in names},
+                                header['typecode'])
 
-        leaf_path = f'{path_prefix}_leaf.pickle'
-        leaf_df = pd.read_pickle(leaf_path)
-        return cls(InternalNodes.load_from_path(path_prefix, data_source), LeafNodes(leaf_df, data_source=data_source), data_source)
+        internal_nodes = InternalNodes(columns('internal', InternalNodes.COLUMNS), header['n_internal'], data_source)
+        leaf_nodes = LeafNodes(columns('leaf', LeafNodes.COLUMNS), header['n_leaf'], data_source)
+        st = cls(internal_nodes, leaf_nodes, data_source, ChildIndex.from_sections(header, sections), codes)
+        internal_nodes.first_leaf = memoryview(sections['first_leaf'])
+        internal_nodes.last_leaf = memoryview(sections['last_leaf'])
+        internal_nodes.nL = memoryview(sections['leaf_count'])
+        st.positions = sections['positions']
+        if 'sequences' in header:
+            st.sequences = SequenceMap.from_header(header['sequences'])
+        st.kmers = KmerTable.from_sections(header, sections)
+        if st.kmers is not None:
+            st.kmer_k = st.kmers.k
+        st.mapped = mm
+        return st
+
+    def finalize(self):
+        """Number the leaves in DFS order, children visited in value order.
+
+        positions[k] is the suffix offset of the k-th leaf, so positions is the suffix array,
+        and the leaves below internal node i are positions[first_leaf[i]:last_leaf[i]],
+        nL[i] is their number, the occurrence count of the path label of i.
+        Structural changes always add a leaf, so the numbering is current while
+        len(positions) == len(leaf_nodes).  With kmer_k set, the KmerTable of kmer_k is built too."""
+        internal_nodes = self.internal_nodes
+        n_internal = len(internal_nodes)
+        children, starts = self._sorted_children()
+
+        first_leaf = [0] * n_internal
+        last_leaf = [0] * n_internal
+        positions = []
+        stack = [internal_nodes.root]
+        while stack:
+            x = stack.pop()
+            if x < 0:
+                positions.append(~x)
+            elif x < n_internal:
+                first_leaf[x] = len(positions)
+                stack.append(x + n_internal)
+                stack.extend(reversed(children[starts[x]:starts[x + 1]]))
+            else:
+                last_leaf[x - n_internal] = len(positions)
+        typecode = internal_nodes.store.typecode
+        internal_nodes.first_leaf = array(typecode, first_leaf)
+        internal_nodes.last_leaf = array(typecode, last_leaf)
+        internal_nodes.nL = array(typecode, map(int.__sub__, last_leaf, first_leaf))
+        self.positions = np.array(positions, dtype=np.dtype(typecode))
+        if self.kmer_k:
+            self.kmers = KmerTable.build(self, self.kmer_k)
+
+    def _sorted_children(self):
+        """children of every internal node in value order, as ChildIndex codes:
+        the children of node i are children[starts[i]:starts[i + 1]]"""
+        parents, values, children = edge_columns(self.internal_nodes, self.leaf_nodes)
+        order = np.lexsort((values, parents))
+        starts = np.searchsorted(parents[order], np.arange(len(self.internal_nodes) + 1))
+        return children[order].tolist(), starts.tolist()
+
+    def to_suffix_array(self):
+        """Suffix array and LCP array from a lexicographic DFS, as int64 numpy arrays.
+
+        lcp[k] is the length of the longest common prefix of suffixes sa[k - 1] and sa[k], lcp[0] is 0.
+        The tree must be finished, with a unique terminator, so that every suffix is a leaf."""
+        internal_nodes = self.internal_nodes
+        iESO, iEEO = internal_nodes.iESO, internal_nodes.iEEO
+        children, starts = self._sorted_children()
+        sa = []
+        lcp = []
+        # string depth of the node a stack entry hangs from, the lcp of two consecutive
+        # leaves is the smallest such depth popped between them
+        stack = [internal_nodes.root]
+        parent_depths = [0]
+        lcp_since_leaf = 0
+        while stack:
+            x = stack.pop()
+            depth = parent_depths.pop()
+            lcp_since_leaf = min(lcp_since_leaf, depth)
+            if x < 0:
+                sa.append(~x)
+                lcp.append(lcp_since_leaf)
+                lcp_since_leaf = len(self.data_source)
+            else:
+                kids = children[starts[x]:starts[x + 1]]
+                stack.extend(reversed(kids))
+                parent_depths.extend([depth + iEEO[x] - iESO[x]] * len(kids))
+        return np.array(sa, dtype=np.int64), np.array(lcp, dtype=np.int64)
+
+    def save_suffix_array(self, path_prefix):
+        """Write the suffix array and LCP array next to the node pickles"""
+        sa, lcp = self.to_suffix_array()
+        np.save(f'{path_prefix}_sa.npy', sa)
+        np.save(f'{path_prefix}_lcp.npy', lcp)
+
+    @staticmethod
+    def load_suffix_array(path_prefix, mmap_mode=None):
+        """Load the (sa, lcp) arrays written by save_suffix_array, memory-mapped if mmap_mode is given"""
+        return (np.load(f'{path_prefix}_sa.npy', mmap_mode=mmap_mode),
+                np.load(f'{path_prefix}_lcp.npy', mmap_mode=mmap_mode))
+
+    def save_kmer_table(self, path_prefix):
+        """Write the k-mer jump table next to the node pickles, load_from_path reads it back"""
+        self.kmers.save(f'{path_prefix}_kmers.npst')
+
+    @property
+    def finalized(self):
+        return self.positions is not None and len(self.positions) == len(self.leaf_nodes)
 
     def find_edge(self, parent_node_id, value):
         """Find an outgoing edge with a specific start value, return that Edge or None if not found"""
-        df = self.internal_nodes.find_edge(parent_node_id, value)
-        if len(df):
-            return Edge(df.iloc[0])
-        df = self.leaf_nodes.find_edge(parent_node_id, value)
-        if len(df):
-            return Edge(df.iloc[0])
-        return None
+        child = self.children.get(parent_node_id, value)
+        if child is None:
+            return None
+        elif child > 0:
+            return Edge(self.internal_nodes, child)
+        else:
+            return Edge(self.leaf_nodes, ~child)
+
+    def find_many(self, patterns):
+        """Search a batch of patterns at once, see suffixtree.search.find_many"""
+        return search.find_many(self, patterns)
+
+    def iter_find_many(self, patterns, batch_size=search.BATCH_SIZE):
+        """Search a stream of patterns batch by batch, see suffixtree.search.iter_find_many"""
+        return search.iter_find_many(self, patterns, batch_size)
+
+    def count(self, pattern):
+        """Number of occurrences of pattern, one walk of its length plus a leaf count lookup"""
+        x = search.locate(self, pattern)
+        return 0 if x is None else (1 if x < 0 else self.internal_nodes.nL[x])
+
+    def find_all(self, pattern):
+        """Offsets of every occurrence of pattern, in lexicographic order of their suffixes, as a numpy array"""
+        x = search.locate(self, pattern)
+        if x is None:
+            return self.positions[:0]
+        if x < 0:
+            return np.array([~x], dtype=self.positions.dtype)
+        return self.positions[self.internal_nodes.first_leaf[x]:self.internal_nodes.last_leaf[x]]
+
+    def location_count(self, location):
+        """Number of occurrences of the string spelled out by the path to location"""
+        if location.on_leaf_edge:
+            return 1
+        if not self.finalized:
+            self.finalize()
+        return self.internal_nodes.nL[location.internal_node_id]
 
     def edges_with_parent(self, internal_node_id):
         """Find all edges with a given internal node parent.
@@ -90,19 +294,39 @@ class SuffixTree:
             internal_node_id)
 
     def depth_exceeds_limit(self, node, limit, offset_on_edge=0):
-        edge = Edge(self.internal_nodes.data.iloc[node])
-        total_depth = len(edge) if not offset_on_edge else offset_on_edge
-        while edge.id != Location.ROOT and total_depth <= limit:
-            node = edge.parent()
-            edge = Edge(self.internal_nodes.data.iloc[node])
-            total_depth += len(edge)
-        return total_depth > limit
+        """True when the string depth at internal node, or offset_on_edge values down its incoming edge,
+        is more than limit"""
+        internal_nodes = self.internal_nodes
+        if offset_on_edge:
+            return internal_nodes.sD[internal_nodes.parent[node]] + offset_on_edge > limit
+        return internal_nodes.sD[node] > limit
+
+    def location_depth(self, location):
+        """Length of the string spelled out by the path to location, the current match length"""
+        if location.on_internal_node:
+            return self.internal_nodes.sD[location.internal_node_id]
+        if location.on_internal_edge:
+            parent = self.internal_nodes.parent[location.internal_node_id]
+        else:
+            parent = self.leaf_nodes.parent[location.leaf_node_id]
+        return self.internal_nodes.sD[parent] + location.incoming_edge_offset
+
+    def locus_location(self, x, depth):
+        """Location depth values down the path to ChildIndex code x, on its incoming edge or on x itself,
+        as KmerTable.lookup gives them"""
+        internal_nodes = self.internal_nodes
+        location = Location()
+        if x > 0:
+            location.internal_edge(internal_nodes.edge(x), depth - internal_nodes.sD[internal_nodes.parent[x]])
+        else:
+            location.leaf_edge(self.leaf_nodes.edge(~x), depth - internal_nodes.sD[self.leaf_nodes.parent[~x]])
+        return location
 
     def edge(self, internal_node_id, leaf_node_id):
         if internal_node_id:
-            return Edge(self.internal_nodes.data.iloc[internal_node_id])
+            return self.internal_nodes.edge(internal_node_id)
         else:
-            return Edge(self.leaf_nodes.data.iloc[leaf_node_id])
+            return self.leaf_nodes.edge(leaf_node_id)
 
     def values_at_location(self, location):
         """returns list of value, node_id, is_leaf_node_flag, incoming_edge_offset"""
@@ -126,13 +350,9 @@ class SuffixTree:
     def root(self):
         return self.internal_nodes.root
 
-    @property
-    def root_node(self):
-        return self.internal_nodes.root_node
-
     @property
     def root_edge(self):
-        return Edge(self.root_node)
+        return self.internal_nodes.root_node
 
     def __repr__(self):
         prefix = "^" if self.internal_nodes.internal_node_location == 0 else ""
@@ -146,33 +366,36 @@ class SuffixTree:
                 child_rows.append(f"{spacing}{self.internal_nodes.to_string(node, self.data_source)}")
             leaf_children = self.leaf_nodes.nodes_with_parent(node)
             child_spacing = spacing + '  '
-            for idx, row in leaf_children.iterrows():
-                child_rows.append(f"{child_spacing}{self.leaf_nodes.to_string(row.name, self.data_source)}")
+            for leaf in leaf_children:
+                child_rows.append(f"{child_spacing}{self.leaf_nodes.to_string(leaf, self.data_source)}")
             internal_children = self.internal_nodes.nodes_with_parent(node)
-            for idx, row in internal_children.iterrows():
-                if row.name != 0:
-                    nodes_to_process.append((row.name, indentation + 1))
+            for child in internal_children:
+                if child != 0:
+                    nodes_to_process.append((child, indentation + 1))
         rows = '\n'.join(child_rows)
         result = f"{root_header}\n{rows}"
         return result
 
     def get_suffixes(self, location):
+        """Suffix offsets of every leaf below location, in DFS (lexicographic) order.
+
+        Returns a zero-copy numpy slice of the positions array, or for a generalized tree
+        a list of (name, position) pairs, leaving out suffixes that start on a separator."""
         if location.on_leaf_edge:
-            #edge = Edge(self.leaf_nodes.data.iloc[location.leaf_node_id])
-            return [location.edge.suffix_offset()]
+            positions = np.array([location.edge.suffix_offset()], dtype=np.int64)
         else:
-            suffixes = []
-            nodes_to_check = [location.internal_node_id]
-            while nodes_to_check:
-                internal_node_id = nodes_to_check.pop()
-                leafs_below = self.leaf_nodes.nodes_with_parent(internal_node_id)
-                internal_below = self.internal_nodes.nodes_with_parent(internal_node_id)
-                if len(leafs_below):
-                    suffixes.extend(leafs_below.index)
-                if len(internal_below):
-                    nodes_to_check.extend(internal_below.index)
-            return sorted(suffixes)
+            if not self.finalized:
+                self.finalize()
+            node = location.internal_node_id
+            positions = self.positions[self.internal_nodes.first_leaf[node]:self.internal_nodes.last_leaf[node]]
+        if self.sequences is not None:
+            return self.sequences.hits(positions)
+        return positions
 
+    def iter_suffixes(self, location, limit=None):
+        """Unsorted suffix offsets (or (name, position) pairs) below location, at most limit of them"""
+        suffixes = self.get_suffixes(location)[:limit]
+        yield from suffixes if self.sequences is not None else suffixes.tolist()
 
 if __name__ == "__main__":
     import doctest
@@ -1,47 +1,247 @@
+from array import array
+
 import numpy as np
 import pandas as pd
 
+from data_source.codes import code_view
+
+
+INTERNAL_COLUMNS = ['parent', 'iESO', 'iESV', 'iEEO', 'sL', 'sD']
+# a leaf only stores its parent: leaf i is the suffix at offset i, so its incoming edge starts
+# at i plus the string depth of its parent, see LeafNodes.edge_start
+LEAF_COLUMNS = ['parent']
+
 
 def empty_internal_df(n):
-    return pd.DataFrame(np.zeros((n, 5), dtype=int), columns=['parent', 'iESO', 'iESV', 'iEEO', 'sL'])
+    return pd.DataFrame(np.zeros((n, len(INTERNAL_COLUMNS)), dtype=int), columns=INTERNAL_COLUMNS)
 
 
-class NodeList:
-    def __init__(self, df, next_idx=None, data_source=None):
+def leaf_df(n):
+    return pd.DataFrame(np.zeros((n, len(LEAF_COLUMNS)), dtype=int), columns=LEAF_COLUMNS)
+
+
+def string_depths(parents, edge_lengths):
+    """string depth of every internal node from its parent and incoming edge length (root is row 0),
+    by pointer jumping: after each round depth[i] covers the path from i up to parent[i]"""
+    parents = np.array(parents, dtype=np.int64)
+    depths = np.array(edge_lengths, dtype=np.int64)
+    depths[0] = 0
+    while parents.any():
+        depths += depths[parents]
+        parents = parents[parents]
+    return depths
+
+
+def typecode_for(n):
+    """narrowest array typecode for the columns of a tree over n values:
+    offsets and node ids are at most n, codes are at most 0x10FFFF, suffix links can be -1"""
+    return 'i' if n < 2 ** 31 - 1 else 'q'
+
+
+class ArrayColumns:
+    """Node storage as plain typed columns, one array.array per node attribute.
+
+    Rows are addressed by integer handle, reading a cell returns a python int,
+    no per-access objects are created. Columns grow in place by doubling."""
+    TYPECODE = 'q'
+
+    def __init__(self, columns, typecode=TYPECODE):
+        self.columns = columns
+        self.typecode = typecode
+        self.dtype = np.dtype(typecode)
+
+    @classmethod
+    def allocate(cls, names, n, typecode=TYPECODE):
+        return cls({name: array(typecode, [0]) * n for name in names}, typecode)
+
+    @classmethod
+    def from_frame(cls, df, typecode=TYPECODE):
+        dtype = np.dtype(typecode)
+        return cls({name: array(typecode, df[name].to_numpy(dtype=dtype).tobytes()) for name in df.columns},
+                   typecode)
+
+    @property
+    def capacity(self):
+        return len(next(iter(self.columns.values())))
+
+    def grow(self, n):
+        """make room for at least n rows, at least doubling the capacity"""
+        padding = array(self.typecode, [0]) * max(n - self.capacity, self.capacity)
+        for column in self.columns.values():
+            column.extend(padding)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def view(self, name, n):
+        """zero-copy numpy view of the first n rows of a column, all rows if n is None"""
+        return np.frombuffer(self.columns[name], dtype=self.dtype, count=-1 if n is None else n)
+
+    def to_frame(self, n):
+        return pd.DataFrame({name: self.view(name, n).astype(np.int64) for name in self.columns})
+
+
+class FrameColumn:
+    """Cell access to one column of a DataFrame, so DataFrame storage has the same API as ArrayColumns"""
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def __getitem__(self, idx):
+        return int(self.store.data.at[idx, self.name])
+
+    def __setitem__(self, idx, value):
+        self.store.data.at[idx, self.name] = value
+
+
+class FrameColumns:
+    """Node storage as a pandas DataFrame, one row per node (the original backend)"""
+    def __init__(self, df):
         self.data = df
+        self.dtype = df.dtypes.iloc[0]
+        self.typecode = self.dtype.char
+
+    @classmethod
+    def allocate(cls, names, n, typecode=ArrayColumns.TYPECODE):
+        return cls(pd.DataFrame(np.zeros((n, len(names)), dtype=typecode), columns=names))
+
+    @property
+    def capacity(self):
+        return len(self.data)
+
+    def grow(self, n):
+        self.data = self.data.reindex(range(max(n, 2 * self.capacity)), fill_value=0)
+
+    def __getitem__(self, name):
+        return FrameColumn(self, name)
+
+    def view(self, name, n):
+        return self.data[name].to_numpy()[:n]
+
+    def to_frame(self, n):
+        return self.data[:n]
+
+
+NODE_STORES = {'array': ArrayColumns, 'dataframe': FrameColumns}
+
+
+def edge_columns(internal_nodes, leaf_nodes):
+    """parent, first value and child for every edge in the tree, as int64 arrays.
+
+    Children use the ChildIndex encoding: internal node id (> 0), or ~leaf_id (< 0)."""
+    n_internal, n_leaf = len(internal_nodes), len(leaf_nodes)
+    parents = np.concatenate([internal_nodes.store.view('parent', n_internal)[1:],
+                              leaf_nodes.store.view('parent', n_leaf)]).astype(np.int64)
+    values = np.concatenate([internal_nodes.edge_values(n_internal)[1:],
+                             leaf_nodes.edge_values(n_leaf)]).astype(np.int64)
+    children = np.concatenate([np.arange(1, n_internal, dtype=np.int64),
+                               ~np.arange(n_leaf, dtype=np.int64)])
+    return parents, values, children
+
+
+# TODO: this needs to replace Location or be merged into it
+class Edge:
+    """API for leaf or internal edge, a handle on one row of InternalNodes or LeafNodes
+
+    If leaf edge, row is:     ['parent'], id is suffix, iESO and iESV are computed, see LeafNodes.edge_start
+    If internal edge, row is: ['parent', 'iESO', 'iESV', 'iEEO', 'sL', 'sD'], id is node_id, root is 0"""
+    __slots__ = ('nodes', 'id', 'is_internal', 'is_leaf')
+
+    def __init__(self, nodes, node_id):
+        self.nodes = nodes
+        self.id = node_id
+        self.is_internal = nodes.is_internal
+        self.is_leaf = not self.is_internal
+
+    def suffix_offset(self):
+        return self.id
+
+    @property
+    def iESO(self):
+        if self.is_leaf:
+            return self.nodes.edge_start(self.id)
+        return self.nodes.iESO[self.id]
+
+    @property
+    def iESV(self):
+        if self.is_leaf:
+            return self.nodes.edge_value(self.id)
+        return self.nodes.iESV[self.id]
+
+    @property
+    def iEEO(self):
+        return self.nodes.iEEO[self.id]
+
+    def parent(self):
+        return self.nodes.parent[self.id]
+
+    def __len__(self):
+        if self.is_internal:
+            return self.nodes.iEEO[self.id] - self.nodes.iESO[self.id]
+        return 0
+
+
+class NodeList:
+    COLUMNS = []
+    is_internal = False
+
+    def __init__(self, store, next_idx=0, data_source=None):
+        self.store = store
+        for name in self.COLUMNS:
+            setattr(self, name, store[name])
         self.data_source = data_source
-        if next_idx is None:
-            x = self.data[self.data.iESO != 0]
-            idx = 0 if not len(x) else max(x.index)
-            self.next_idx = idx + 1
-        else:
-            self.next_idx = next_idx
+        # ChildIndex shared by the internal and leaf node tables, attached by SuffixTree
+        self.children = None
+        # ids of existing rows changed since the last checkpoint, a set while checkpointing is on
+        self.dirty = None
+        self.next_idx = next_idx
+
+    @classmethod
+    def allocate(cls, n, data_source=None, backend='array', typecode=ArrayColumns.TYPECODE):
+        return cls(NODE_STORES[backend].allocate(cls.COLUMNS, n, typecode), data_source=data_source)
 
     def to_pickle(self, filepath):
-        df = self.data[:self.next_idx]
+        df = self.store.to_frame(self.next_idx)
         df.to_pickle(f'{filepath}.pickle')
 
     def nodes_with_parent(self, parent):
-        df = self.data.iloc[:self.next_idx]
-        return df[df.parent == parent]
+        """row handles of all nodes with the given parent"""
+        return np.flatnonzero(self.store.view('parent', self.next_idx) == parent).tolist()
 
     def find_edge(self, parent_id, value):
-        df = self.data.iloc[:self.next_idx]
-        return df[(df.parent == parent_id) & (df.iESV == value)]
+        """row handle of the node below parent_id whose incoming edge starts with value, None if there is none"""
+        if self.children is not None:
+            return self.from_child(self.children.get(parent_id, value))
+        n = self.next_idx
+        hits = np.flatnonzero((self.store.view('parent', n) == parent_id) & (self.edge_values(n) == value))
+        return int(hits[0]) if len(hits) else None
+
+    def edge_values(self, n):
+        """first value of the incoming edge of the first n rows, as a numpy array"""
+        return self.store.view('iESV', n)
+
+    def from_child(self, child):
+        """row handle for a ChildIndex entry, None if the entry is not in this table"""
+        raise NotImplementedError
+
+    def edge(self, item):
+        return Edge(self, item)
 
     def __len__(self):
         return self.next_idx
 
     def __getitem__(self, item):
-        return self.data.iloc[item]
+        return self.edge(item)
 
 
 class InternalNodes(NodeList):
-    def __init__(self, df, next_idx=None, data_source=None):
+    COLUMNS = INTERNAL_COLUMNS
+    is_internal = True
+
+    def __init__(self, store, next_idx=1, data_source=None):
         """Root is at offset 0, all values 0"""
-        super().__init__(df, next_idx, data_source)
+        super().__init__(store, next_idx, data_source)
         self.root = 0
-        # self.data.at[0, 'parent'] = -1
 
         # just for repr
         self.internal_node_location = None
@@ -50,81 +250,162 @@ class InternalNodes(NodeList):
     def load_from_path(cls, path_prefix, data_source):
         internal_path = f'{path_prefix}_internal.pickle'
         internal_df = pd.read_pickle(internal_path)
-        return InternalNodes(internal_df, next_idx=None, data_source=data_source)
+        if 'sD' not in internal_df:
+            # pickles written before string depths were stored
+            internal_df['sD'] = string_depths(internal_df['parent'], internal_df['iEEO'] - internal_df['iESO'])
+        return cls(ArrayColumns.from_frame(internal_df, typecode_for(len(data_source))),
+                   next_idx=len(internal_df), data_source=data_source)
 
     @property
     def root_node(self):
-        return self.data.iloc[0]
+        return self.edge(self.root)
 
-    def __getitem__(self, item):
-        return self.data.iloc[item]
+    def from_child(self, child):
+        return child if child is not None and child > 0 else None
 
     def __repr__(self):
         nodes = [self.to_string(i, self.data_source) for i in range(self.next_idx)]
         return "\n".join(nodes)
 
     def add_node(self, parent, iESO, iESV, iEEO, sL=-1):
-        """parent, incoming_edge_start_offset, incoming_edge_start_value, incoming_edge_end_offset, suffix_link"""
-        self.data.iloc[self.next_idx] = (parent, iESO, iESV, iEEO, sL)
+        """parent, incoming_edge_start_offset, incoming_edge_start_value, incoming_edge_end_offset, suffix_link.
+
+        The string depth sD is the parent's plus the edge length, it never changes afterwards:
+        a split inserts a node above a child without changing the child's path label"""
+        idx = self.next_idx
+        if idx >= self.store.capacity:
+            self.store.grow(idx + 1)
+        self.parent[idx] = parent
+        self.iESO[idx] = iESO
+        self.iESV[idx] = iESV
+        self.iEEO[idx] = iEEO
+        self.sL[idx] = sL
+        self.sD[idx] = self.sD[parent] + iEEO - iESO
         self.next_idx += 1
-        return self.next_idx - 1
+        if self.children is not None:
+            self.children.add(parent, iESV, idx)
+        return idx
 
     def update_internal_child(self, original_child, new_parent, new_iESO, new_iESV):
         """When an internal node is added, an internal edge is split,
         'add_node' adds the new internal node, this method updates the
         original child node with its new parent, iESO, iESV"""
-        self.data.at[original_child, 'parent'] = new_parent
-        self.data.at[original_child, 'iESO'] = new_iESO
-        self.data.at[original_child, 'iESV'] = new_iESV
+        self.parent[original_child] = new_parent
+        self.iESO[original_child] = new_iESO
+        self.iESV[original_child] = new_iESV
+        if self.children is not None:
+            self.children.add(new_parent, new_iESV, original_child)
+        if self.dirty is not None:
+            self.dirty.add(original_child)
 
     def set_suffix_link(self, node, link_value):
-        self.data.at[node, 'sL'] = link_value
+        self.sL[node] = link_value
+        if self.dirty is not None:
+            self.dirty.add(node)
 
     def to_string(self, row_idx, data_source):
         if row_idx >= self.next_idx:
             return ''
         else:
-            row = self.data.iloc[row_idx]
+            iESO, iEEO = self.iESO[row_idx], self.iEEO[row_idx]
             prefix = "^" if row_idx == self.internal_node_location else ""
-            data_str = data_source[row.iESO:row.iEEO]
-            return f"{data_str} {prefix} p.{row.parent} sl.{row.sL} (iESO={row.iESO}, iEEO={row.iEEO}, iESV='{chr(row.iESV)}') .{row_idx}."
+            data_str = data_source[iESO:iEEO]
+            return f"{data_str} {prefix} p.{self.parent[row_idx]} sl.{self.sL[row_idx]} (iESO={iESO}, iEEO={iEEO}, iESV='{chr(self.iESV[row_idx])}') .{row_idx}."
 
 
-def leaf_df(n):
-    return pd.DataFrame(np.zeros((n, 3), dtype=int), columns=['parent', 'iESO', 'iESV'])
+class ImplicitColumn:
+    """Read-only column computed from a row handle, for the leaf columns that are not stored"""
+    __slots__ = ('fn',)
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __getitem__(self, idx):
+        return self.fn(idx)
 
 
 class LeafNodes(NodeList):
-    def __init__(self, df, next_idx=None, data_source=None, next_offset_to_process=None):
-        super().__init__(df, next_idx, data_source)
+    """Leaf i is the suffix at offset i, only its parent is stored.
+
+    Its incoming edge runs from i plus the string depth of its parent to the end of the text,
+    so iESO and iESV are computed from the parent's sD and the code array, attached by SuffixTree"""
+    COLUMNS = LEAF_COLUMNS
+
+    def __init__(self, store, next_idx=0, data_source=None, next_offset_to_process=None):
+        super().__init__(store, next_idx, data_source)
+        # string depths of the internal nodes and the code array, see attach
+        self.depths = None
+        self.codes = None
+        self.iESO = ImplicitColumn(self.edge_start)
+        self.iESV = ImplicitColumn(self.edge_value)
         # these are only for __repr__
         self.next_offset_to_process = next_offset_to_process
         self.leaf_node_with_edge = None
         self.incoming_edge_offset = None
 
+    @classmethod
+    def load_from_path(cls, path_prefix, data_source):
+        leaf_path = f'{path_prefix}_leaf.pickle'
+        # pickles written before leaves were implicit also have iESO and iESV columns
+        leaf_df = pd.read_pickle(leaf_path)[LEAF_COLUMNS]
+        return cls(ArrayColumns.from_frame(leaf_df, typecode_for(len(data_source))),
+                   next_idx=len(leaf_df), data_source=data_source)
+
+    def attach(self, internal_nodes, codes):
+        """the internal node table and code array the incoming edges are computed from"""
+        self.internal_nodes = internal_nodes
+        self.depths = internal_nodes.sD
+        self.codes = codes
+
     def __repr__(self):
         nodes = [self.to_string(i, self.data_source) for i in range(self.next_idx)]
         return "\n".join(nodes)
 
+    def from_child(self, child):
+        return ~child if child is not None and child < 0 else None
+
+    def edge_start(self, leaf):
+        """iESO, the text offset where the incoming edge of leaf starts"""
+        return leaf + self.depths[self.parent[leaf]]
+
+    def edge_value(self, leaf):
+        """iESV, the first value of the incoming edge of leaf"""
+        return self.codes[leaf + self.depths[self.parent[leaf]]]
+
+    def edge_starts(self, n):
+        """iESO of the first n leaves, as an int64 numpy array"""
+        depths = self.internal_nodes.store.view('sD', len(self.internal_nodes))
+        return np.arange(n, dtype=np.int64) + depths[self.store.view('parent', n)]
+
+    def edge_values(self, n):
+        return code_view(self.codes)[self.edge_starts(n)]
+
     def add(self, parent_node, iESO, iESV):
-        self.data.iloc[self.next_idx] = (parent_node, iESO, iESV)
+        """leaf for the suffix at offset len(self), its incoming edge starts at iESO with iESV"""
+        idx = self.next_idx
+        if idx >= self.store.capacity:
+            self.store.grow(idx + 1)
+        self.parent[idx] = parent_node
         self.next_idx += 1
+        if self.children is not None:
+            self.children.add(parent_node, iESV, ~idx)
 
     def update_leaf_child(self, original_child, new_parent, new_iESO, new_iESV):
-        """When an internal node is added, an internal edge is split,
-        'add_node' adds the new internal node, this method updates the
-        original child node with its new parent, iESO, iESV"""
-        self.data.iloc[original_child] = (new_parent, new_iESO, new_iESV)
+        """When a leaf edge is split, 'add_node' adds the new internal node, this method moves
+        the original leaf below it, new_iESO and new_iESV follow from the new parent's depth"""
+        self.parent[original_child] = new_parent
+        if self.children is not None:
+            self.children.add(new_parent, new_iESV, ~original_child)
+        if self.dirty is not None:
+            self.dirty.add(original_child)
 
     def to_string(self, row_idx, data_source):
         if row_idx >= len(self):
             return ''
         else:
-            row = self.data.iloc[row_idx]
-            data_str = data_source[row.iESO:]
-            if self.next_offset_to_process and self.leaf_node_with_edge==row.name and self.incoming_edge_offset:
-                boundary = row.iESO + self.incoming_edge_offset
-                data_str = f'{data_source[row.iESO:boundary]}^{data_source[boundary:]}'
-            return f"{data_str} p.{row.parent} (iESO={row.iESO}, iESV='{chr(row.iESV)}') -{row_idx}-"
-
-
+            iESO = self.edge_start(row_idx)
+            data_str = data_source[iESO:]
+            if self.next_offset_to_process and self.leaf_node_with_edge == row_idx and self.incoming_edge_offset:
+                boundary = iESO + self.incoming_edge_offset
+                data_str = f'{data_source[iESO:boundary]}^{data_source[boundary:]}'
+            return f"{data_str} p.{self.parent[row_idx]} (iESO={iESO}, iESV='{chr(self.edge_value(row_idx))}') -{row_idx}-"
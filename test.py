@@ -1,7 +1,15 @@
 import argparse
+import os
+import sys
 from suffixtree.builder.tree_builder import TreeBuilder
+from suffixtree.builder.telemetry import MemoryBudgetExceeded, parse_bytes
+from suffixtree.profiler import RuleProfiler
 from time import perf_counter
-from data_source.fasta import get_fasta_data
+from data_source.fasta import get_fasta_data, IndexedFasta
+from data_source.codes import write_data_file
+
+# exit status of a build stopped at --max-memory, EX_TEMPFAIL: run again with more memory to continue
+EXIT_STOPPED = 75
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-s', '--str', help="test string", dest="test_string")
@@ -10,12 +18,56 @@ parser.add_argument('-r', '--random', help="random text with length provided", d
 parser.add_argument('-st', help="file prefix for pickled suffix tree", dest="suffix_tree_prefix")
 parser.add_argument('--fasta', help='fasta file to use as data source', dest='fasta_file')
 parser.add_argument('--slice', help='slice into data source, 1Mb units', dest='slice')
-parser.add_argument("output_file")
-parser.add_argument("expected_file")
-parser.add_argument("recorded_time")
+parser.add_argument('--record', help='name of the fasta record to use, defaults to the first', dest='record')
+parser.add_argument('--all-records', help='build one generalized tree over every record of the fasta file',
+                    action='store_true', dest='all_records')
+parser.add_argument('--mapped', help='also save the tree in the mmap format (prefix.npst)',
+                    action='store_true', dest='mapped')
+parser.add_argument('--suffix-array', help='also save suffix array and LCP array with the pickles',
+                    action='store_true', dest='suffix_array')
+parser.add_argument('--save-state', help='build without the terminator and save the builder state here, '
+                    'so a later run can --resume it', dest='save_state')
+parser.add_argument('--resume', help='continue the build saved with --save-state with the text of this run',
+                    dest='resume')
+parser.add_argument('--checkpoint', help='checkpoint directory, a build with a checkpoint there continues from it',
+                    dest='checkpoint')
+parser.add_argument('--checkpoint-every', help='checkpoint after this many values', type=int,
+                    dest='checkpoint_every')
+parser.add_argument('--checkpoint-seconds', help='checkpoint after this many seconds', type=float,
+                    dest='checkpoint_seconds')
+parser.add_argument('--profile', help='profile the builder rules, print a summary and dump the statistics as json here',
+                    dest='profile')
+parser.add_argument('--telemetry', help='append build telemetry as json lines to this file', dest='telemetry')
+parser.add_argument('--telemetry-seconds', help='seconds between telemetry lines', type=float, default=10.0,
+                    dest='telemetry_seconds')
+parser.add_argument('--max-memory', help='stop the build cleanly when the process RSS reaches this, e.g. 12G; '
+                    'combine with --checkpoint or --save-state to continue it later, and leave out the output file, '
+                    'the RSS of a traced build counts the trace', dest='max_memory')
+parser.add_argument('--kmer', help='also save a k-mer jump table of this k, searches start at depth k with one lookup',
+                    type=int, dest='kmer')
+parser.add_argument("output_file", nargs='?',
+                    help="trace the build and write its history here, without it the build is not traced")
+parser.add_argument("expected_file", nargs='?', help="golden history to compare the output_file with")
+parser.add_argument("recorded_time", nargs='?', type=float,
+                    help="warn if the build time differs more than a second, see benchmark.py suite for timings")
 args = parser.parse_args()
 
 test_string = args.test_string
+# the trace keeps the context of every step, several times the memory and time of the build itself
+trace = args.output_file is not None
+tbuilder = None
+every, seconds = args.checkpoint_every, args.checkpoint_seconds or (None if args.checkpoint_every else 60)
+restored = args.checkpoint is not None and os.path.exists(os.path.join(args.checkpoint, 'base.npst'))
+if restored:
+    # the checkpoint holds the text and the builder state, the trace would miss the steps before it
+    trace = False
+    tbuilder = TreeBuilder.restore(args.checkpoint, every, seconds)
+    test_string = tbuilder.st.data_source
+    print(f"restored checkpoint at offset {tbuilder.next_offset_to_process}")
+if tbuilder is None and args.all_records:
+    fasta = IndexedFasta(args.fasta_file)
+    tbuilder = TreeBuilder.from_sequences((fasta.sequence(name) for name in fasta.names), fasta.names, trace=trace)
+    test_string = tbuilder.st.data_source
 if test_string is None:
     test_file = args.test_file
     if test_file is not None:
@@ -24,48 +76,92 @@ if test_string is None:
 if test_string is None:
     seq_file = args.fasta_file
     if seq_file:
-        test_string = get_fasta_data(seq_file, args.slice)
+        test_string = get_fasta_data(seq_file, args.slice, args.record)
 
-test_string += "$"
-tbuilder = TreeBuilder(test_string)
+if tbuilder is None:
+    if not args.save_state:
+        test_string += "$"
+    if args.resume:
+        tbuilder = TreeBuilder.resume(args.resume, trace=trace)
+        tbuilder.append_data(test_string)
+    else:
+        tbuilder = TreeBuilder(test_string, trace=trace)
+if args.checkpoint and not restored:
+    tbuilder.checkpoint_every(args.checkpoint, every, seconds)
+if args.profile:
+    profiler = RuleProfiler()
+    tbuilder.attach(profiler)
+if args.telemetry or args.max_memory:
+    tbuilder.monitor(args.telemetry, args.telemetry_seconds,
+                     max_memory=parse_bytes(args.max_memory) if args.max_memory else None)
+first_offset = tbuilder.next_offset_to_process
 
 start_time = perf_counter()
 kstart = perf_counter()
-total_length = len(test_string)
-for o, v in enumerate(test_string):
-    start = perf_counter()
-    tbuilder.process_value(o, v)
-    end = perf_counter()
-    if (o % 1000) == 0:
-        kend = perf_counter()
-        print(f"{o*100/total_length:.2f}% {o}, {v}, {kend - kstart:.2f}")
-        kstart = kend
+total_length = len(tbuilder.st.codes)
+try:
+    for o, v in enumerate(tbuilder.st.codes[first_offset:], first_offset):
+        start = perf_counter()
+        tbuilder.process_value(o, v)
+        end = perf_counter()
+        if (o % 1000) == 0:
+            kend = perf_counter()
+            print(f"{o*100/total_length:.2f}% {o}, {chr(v)}, {kend - kstart:.2f}")
+            kstart = kend
+except MemoryBudgetExceeded as stop:
+    print(f"**** STOPPED, {stop}")
+    if stop.status['checkpoint']:
+        print(f"continue with --checkpoint {stop.status['checkpoint']}")
+    if args.save_state:
+        tbuilder.save_state(args.save_state)
+        print(f"continue with --resume {args.save_state}")
+    sys.exit(EXIT_STOPPED)
+if tbuilder.telemetry is not None:
+    tbuilder.telemetry.finish()
 
 end_time = perf_counter()
 if len(test_string) > 30:
     test_string = f"{test_string[:30]}..."
 
 print(test_string, f"{end_time - start_time:.02f}")
-if abs((end_time - start_time) - int(args.recorded_time)) > 1:
+if args.recorded_time is not None and abs((end_time - start_time) - args.recorded_time) > 1:
     print(f"**** FAILED, before duration {args.recorded_time}, this duration {end_time - start_time}")
     # print()
     # tbuilder.show_tree(f"************* After {o}, {v}")
     # print()
 
+if args.profile:
+    tbuilder.detach(profiler)
+    print(profiler.summary())
+    profiler.dump(args.profile)
+
+if args.save_state:
+    tbuilder.save_state(args.save_state)
+
 if args.suffix_tree_prefix:
     tbuilder.st.internal_nodes.to_pickle(f"{args.suffix_tree_prefix}_internal")
     tbuilder.st.leaf_nodes.to_pickle(f"{args.suffix_tree_prefix}_leaf")
-    with open(f'{args.suffix_tree_prefix}.data', 'w') as out_file:
-        out_file.write(str(tbuilder.st.data_source))
-
+    write_data_file(f'{args.suffix_tree_prefix}.data', tbuilder.st.data_source)
+    if tbuilder.st.sequences is not None:
+        tbuilder.st.sequences.save(f'{args.suffix_tree_prefix}_sequences.json')
+    if args.kmer:
+        tbuilder.st.kmer_k = args.kmer
+        tbuilder.st.finalize()
+        tbuilder.st.save_kmer_table(args.suffix_tree_prefix)
+    if args.mapped:
+        tbuilder.st.save_mapped(args.suffix_tree_prefix)
+    if args.suffix_array:
+        tbuilder.st.save_suffix_array(args.suffix_tree_prefix)
 
-with open(args.output_file, "w") as out_file:
-    out_file.write(tbuilder.context_recorder.history())
+if trace:
+    with open(args.output_file, "w") as out_file:
+        out_file.write(tbuilder.context_recorder.history())
 
-with open(args.expected_file) as expected_results, open(args.output_file) as actual_results:
-    expected_lines = expected_results.readlines()
-    actual_lines = actual_results.readlines()
-    if len(expected_lines) != len(actual_lines):
-        print(f"*** FAILED, expected {len(expected_lines)} lines, got {len(actual_lines)}")
-    print(f"diff {args.expected_file} {args.output_file}")
+if trace and args.expected_file:
+    with open(args.expected_file) as expected_results, open(args.output_file) as actual_results:
+        expected_lines = expected_results.readlines()
+        actual_lines = actual_results.readlines()
+        if len(expected_lines) != len(actual_lines):
+            print(f"*** FAILED, expected {len(expected_lines)} lines, got {len(actual_lines)}")
+        print(f"diff {args.expected_file} {args.output_file}")
 
@@ -1,8 +1,11 @@
 import argparse
 import random
 from suffixtree.location import Location
-from suffixtree.suffixtree import SuffixTree, Edge
+from suffixtree.suffixtree import SuffixTree
 from suffixtree.builder.tree_builder import ValueProcessor
+from suffixtree.kmer_table import ABSENT
+from suffixtree.query_pool import QueryPool
+from data_source.codes import to_codes
 from time import perf_counter
 
 parser = argparse.ArgumentParser()
@@ -11,6 +14,9 @@ parser.add_argument('-st', '--suffix-tree', help="file prefix for pickled suffix
 parser.add_argument('-sd', '--seed', help="seed for random repeatability", dest="seed", default=0, type=int)
 parser.add_argument('-f', '--file', help="file containing text", dest="test_file")
 parser.add_argument('-n', help="number of tests to run", default=1000, type=int)
+parser.add_argument('-b', '--batch', help="search all test strings with one find_many call", action='store_true')
+parser.add_argument('-j', '--jobs', help="with --batch, search in this many worker processes sharing the mapped tree",
+                    type=int)
 args = parser.parse_args()
 
 start = perf_counter()
@@ -28,13 +34,25 @@ class TreeSearcher:
         self.st = st
 
     def find(self, s):
+        codes = to_codes(s)
+        start = 0
         location = Location()
-        location.internal_node(Edge(self.st.root_node))
+        location.internal_node(self.st.root_edge)
+        kmers = self.st.kmers
+        if kmers is not None:
+            # start at depth k with one lookup when the tree has a k-mer jump table
+            x = kmers.lookup(codes)
+            if x == ABSENT:
+                print(f"Failed in the first {kmers.k}")
+                return False, None
+            if x is not None:
+                location = self.st.locus_location(x, kmers.k)
+                start = kmers.k
         vp = ValueProcessor(self.st, location, data_source)
-        for offset, value in enumerate(s):
+        for offset, value in enumerate(codes[start:], start):
             vp.process(offset, value)
             if not vp.succeeded:
-                print(f"Failed at {offset}, {value}")
+                print(f"Failed at {offset}, {chr(value)}")
                 return False, None
         return True, location
 
@@ -51,6 +69,19 @@ def random_bounds(n):
     return lower, upper
 
 
+if args.batch:
+    test_strings = [data_source[lower:upper] for lower, upper in (random_bounds(len(data_source)) for _ in range(args.n))]
+    if args.jobs:
+        with QueryPool(args.suffix_tree_prefix, args.jobs) as pool:
+            matches = pool.find_many(test_strings, chunk_size=-(-len(test_strings) // args.jobs))
+    else:
+        matches = st.find_many(test_strings)
+    for test_string, found, position in zip(test_strings, matches.found, matches.position):
+        assert found, f"..NOT FOUND {test_string}"
+        assert data_source[position:position + len(test_string)] == test_string
+    print(f"done, {perf_counter() - start:.2f}")
+    exit(0)
+
 tree_searcher = TreeSearcher(st)
 for i in range(args.n):
     lower, upper = random_bounds(len(data_source))
@@ -1,16 +1,23 @@
 from st_cli_args import st_args
-from functools import partial
+from functools import partial, wraps
 
 from data_source.fasta import get_fasta_data_str
-from suffixtree.location import Location
-from suffixtree.suffixtree import SuffixTree, Edge
+from data_source.codes import to_codes, N
+from suffixtree.matcher import StreamMatcher
+from suffixtree.profiler import RuleProfiler
+from suffixtree.suffixtree import SuffixTree
 import pickle
 
 EMIT_DEPTH = 10
 """
 Usage:  python visualize.py -suffixtree <suffix tree name> --depth <emit_at_depth> --fasta .. --slice ..
 
-This takes the fasta sequence, and matches it against the suffix tree.
+This takes the fasta sequence, and matches it against the suffix tree with a StreamMatcher,
+emitting the suffixes of every match longer than the depth.
+--restart root (the default) starts over at the root after a mismatch or an emit,
+--restart suffix_link keeps the longest match through suffix links and also emits overlapping matches.
+A tree saved with a k-mer jump table (test.py --kmer, k no more than the depth) starts every match
+from the root with one lookup of the next k values instead of feeding them one at a time.
 """
 fn_counts = {}
 
@@ -18,6 +25,7 @@ fn_counts = {}
 def count_calls(fn):
     fn_counts[fn.__name__] = 0
 
+    @wraps(fn)
     def inner(*args, **kwargs):
         fn_counts[fn.__name__] += 1
         return fn(*args, **kwargs)
@@ -37,61 +45,83 @@ def verification_finder(data_source, s, *, emit_depth):
                 break
 
 @count_calls
-def _emit_suffixes(offset, value, data_source, location, st, *, output_file, emit_depth):
-    suffixes = st.get_suffixes(location)
+def _emit_suffixes(offset, value, matcher, st, *, output_file, emit_depth):
+    location = matcher.location()
+    suffixes = list(st.iter_suffixes(location))
 
-    verification_str = data_source[location.offset - emit_depth:location.offset]
+    text_end = matcher.text_end()
+    verification_str = st.data_source[text_end - emit_depth:text_end]
     # verification_suffixes = list(verification_finder(data_source, verification_str))
     found_location = offset - len(verification_str)
     pickle.dump((found_location,suffixes), output_file)
-    print(f"offset_value_processed=({offset},{value}),"
+    print(f"offset_value_processed=({offset},{chr(value)}),"
           f"found_location={found_location},"
           f"slen={len(verification_str)},suffixes={suffixes},"
-          f"verification_str='{verification_str}',location_offset={location.offset}")
+          f"verification_str='{verification_str}',location_offset={text_end}")
 
     #print(f"offset_value_processed=({offset},{value}),found_location={found_location},slen={len(verification_str)},suffixes={suffixes},verification_str='{verification_str}',location_offset={location.offset},{verification_suffixes}")
     return True
 
 @count_calls
-def _emit_check(offset, value, data_source, location, st, *, emit_depth):
-    # print(f"_emit_check {location.internal_node_id}, depth={emit_depth}")
-    if location.on_internal_node:
-        return st.depth_exceeds_limit(location.internal_node_id, emit_depth)
-    elif location.on_internal_edge:
-        return st.depth_exceeds_limit(location.internal_node_id, emit_depth, location.incoming_edge_offset)
-    else:
-        # not handling leaf edges
-        return False
+def _emit_check(offset, value, matcher, st, *, emit_depth):
+    # not handling leaf edges
+    return matcher.match_length > emit_depth and matcher.locus >= 0
 
 @count_calls
-def _goto_root(offset, value, data_source, location, st):
-    location.internal_node(st.root_edge)
+def _frequency_check(offset, value, matcher, st, *, min_count, max_count):
+    count = st.location_count(matcher.location())
+    return (min_count is None or count >= min_count) and (max_count is None or count <= max_count)
 
 @count_calls
-def _traverse(offset, value, data_source, location, st):
-    if location.on_internal_edge or location.on_leaf_edge:
-        if data_source[location.offset] == value:
-            location.down(st.edge(location.internal_node_id, location.leaf_node_id))
-            return True
-    else:
-        edge = st.find_edge(location.internal_node_id, ord(value))
-        if edge is not None:
-            location.update(edge)
-            return True
-    return False
+def _shorten(offset, value, matcher, st):
+    """after an emit, drop the first value of the match: back to the root with --restart root,
+    along a suffix link with --restart suffix_link, so overlapping matches are emitted too"""
+    matcher.shorten()
+
+@count_calls
+def _jump(offset, window, matcher, st):
+    """from the root, match the k values of window at once: no emit or mismatch can come
+    before the k-th value when k is no more than the emit depth"""
+    return N not in window and matcher.jump(window)
+
+@count_calls
+def _feed(offset, value, matcher, st):
+    return matcher.feed(value) > 0
 
 
 class RuleRunner:
-    def __init__(self, rules, data_source, location, st):
+    """Runs the rules after each value fed to a StreamMatcher, starting from _feed.
+    Observers attached (suffixtree.profiler.RuleProfiler) are called like build observers, see TreeBuilder.attach"""
+    def __init__(self, rules, matcher, st):
         self.rules = rules
-        self.data_source = data_source
-        self.location = location
+        self.matcher = matcher
         self.st = st
+        self.observers = []
+
+    @property
+    def hops(self):
+        return self.matcher.hops
+
+    def attach(self, observer):
+        self.observers.append(observer)
+
+    def detach(self, observer):
+        self.observers.remove(observer)
 
     def process(self, offset, value):
-        fn = _traverse
+        observers = self.observers
+        for observer in observers:
+            observer.step_processing(offset, value)
+        fn = _feed
         while True:
-            result = fn(offset, value, self.data_source, self.location, self.st)
+            if observers:
+                for observer in observers:
+                    observer.before_rule(fn, self)
+                result = fn(offset, value, self.matcher, self.st)
+                for observer in observers:
+                    observer.after_rule(fn, self)
+            else:
+                result = fn(offset, value, self.matcher, self.st)
             if fn in self.rules:
                 if result and self.rules[fn].get(TRUTHY, None):
                     fn = self.rules[fn].get(TRUTHY)
@@ -101,7 +131,6 @@ class RuleRunner:
                     break
             else:
                 break
-        # print(f"{offset},{value} => {self.location}")
 
 
 TRUTHY = "OK"
@@ -109,35 +138,52 @@ FALSY = "FAIL"
 
 args = st_args()
 _emit_check = partial(_emit_check, emit_depth=args.emit_depth)
+_frequency_check = partial(_frequency_check, min_count=args.min_count, max_count=args.max_count)
 
 with open(args.output_file, 'wb') as output_file:
     _emit_suffixes = partial(_emit_suffixes, output_file=output_file, emit_depth=args.emit_depth)
 
     emit_rules = {
-        _traverse: {TRUTHY: _emit_check, FALSY: _goto_root},
-        _emit_check: {TRUTHY: _emit_suffixes },
-        _emit_suffixes: {TRUTHY: _goto_root},
-        _goto_root: {}
+        _feed: {TRUTHY: _emit_check},
+        _emit_check: {TRUTHY: _emit_suffixes},
+        _emit_suffixes: {TRUTHY: _shorten},
+        _shorten: {}
     }
+    if args.min_count is not None or args.max_count is not None:
+        # only emit matches that occur in the tree a number of times within the limits
+        emit_rules[_emit_check] = {TRUTHY: _frequency_check}
+        emit_rules[_frequency_check] = {TRUTHY: _emit_suffixes}
 
     # load the suffix tree
     st = SuffixTree.load_from_path(args.suffix_tree_prefix)
-    st_location = Location()
-    st_location.internal_node(Edge(st.root_node))
+    matcher = StreamMatcher(st, restart=args.restart)
 
     # load the stream to match
-    match_seq = get_fasta_data_str(args.fasta_file, args.slice_spec)
+    match_seq = get_fasta_data_str(args.fasta_file, args.slice_spec, args.record)
 
-    tree_matcher = RuleRunner(emit_rules, st.data_source, st_location, st)
+    tree_matcher = RuleRunner(emit_rules, matcher, st)
+    profiler = None
+    if args.profile:
+        profiler = RuleProfiler()
+        tree_matcher.attach(profiler)
 
     print(f"len(match_seq)={len(match_seq)}")
-    for offset, value in enumerate(match_seq):
-        if value != 'N':
-            tree_matcher.process(offset, value)
-        if offset % 1000 == 0:
-            print(f"{offset}...{fn_counts}")
+    codes = to_codes(match_seq)
+    k = st.kmers.k if st.kmers is not None and st.kmers.k <= args.emit_depth else 0
+    offset = 0
+    next_report = 0
+    while offset < len(codes):
+        if k and not matcher.match_length and _jump(offset, codes[offset:offset + k], matcher, st):
+            offset += k
+        else:
+            value = codes[offset]
+            if value != N:
+                tree_matcher.process(offset, value)
+            offset += 1
+        while next_report < offset:
+            print(f"{next_report}...{fn_counts}")
+            next_report += 1000
     print(f"done")
-
-
-
-
+    if profiler is not None:
+        print(profiler.summary())
+        profiler.dump(args.profile)